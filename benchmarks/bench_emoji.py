@@ -0,0 +1,96 @@
+"""Benchmark for rendering a page of toots with TootParser.
+
+Parses a 40 toot page with emoji conversion disabled, converting short
+codes to unicode and converting unicode to short codes.  For comparison it
+also runs the old approach of calling the emoji package on every text
+fragment between tags.
+
+    python benchmarks/bench_emoji.py
+"""
+import timeit
+
+import emoji
+
+from tootstream.toot_parser import TootParser
+
+PAGE_SIZE = 40
+ROUNDS = 20
+
+TOOTS = [
+    '<p>Toot number {0} from <span class="h-card">'
+    '<a href="https://example.org/@alice" class="u-url mention">@<span>alice'
+    '</span></a></span> with a <a href="https://example.org/tags/tootstream" '
+    'class="mention hashtag">#<span>tootstream</span></a> tag :tada: and a link '
+    '<a href="https://example.com/a/long/path/{0}"><span class="invisible">https://'
+    '</span><span class="ellipsis">example.com/a/long/</span>'
+    '<span class="invisible">path/{0}</span></a></p><p>Second paragraph, '
+    "café \U0001f600 and some more words to make it wrap :thumbsup:<br>last line"
+    "</p>".format(i)
+    if i % 2
+    else "<p>Plain ASCII toot number {0} without any emoji at all, just words and "
+    "punctuation; times like 12:30 still have colons.</p>".format(i)
+    for i in range(PAGE_SIZE)
+]
+
+
+def _emojize(text):
+    try:
+        return emoji.emojize(text, language="alias")
+    except TypeError:
+        return emoji.emojize(text, use_aliases=True)
+
+
+class PerFragmentParser(TootParser):
+    """The old behaviour: convert every fragment between tags."""
+
+    def handle_data(self, data):
+        if self.hide:
+            return
+        if self.convert_emoji_to_unicode:
+            data = _emojize(data)
+        if self.convert_emoji_to_shortcode:
+            data = emoji.demojize(data)
+        self.fed.append(data)
+
+    def get_text(self):
+        unicode = self.convert_emoji_to_unicode
+        shortcode = self.convert_emoji_to_shortcode
+        self.convert_emoji_to_unicode = self.convert_emoji_to_shortcode = False
+        try:
+            return super().get_text()
+        finally:
+            self.convert_emoji_to_unicode = unicode
+            self.convert_emoji_to_shortcode = shortcode
+
+
+def render_page(parser):
+    for toot in TOOTS:
+        parser.parse(toot)
+        parser.get_text()
+
+
+def bench(parser_class, **kwargs):
+    parser = parser_class(indent="  ", width=78, shorten_links=True, **kwargs)
+    # build lookup tables outside of the timing
+    render_page(parser)
+    return timeit.timeit(lambda: render_page(parser), number=ROUNDS) / ROUNDS * 1e3
+
+
+def main():
+    cases = (
+        ("no conversion", {}),
+        ("shortcode -> unicode", {"convert_emoji_to_unicode": True}),
+        ("unicode -> shortcode", {"convert_emoji_to_shortcode": True}),
+    )
+    print("{}-toot page, ms per page".format(PAGE_SIZE))
+    print("{:<22} {:>12} {:>14}".format("", "per toot", "per fragment"))
+    for name, kwargs in cases:
+        print(
+            "{:<22} {:>12.2f} {:>14.2f}".format(
+                name, bench(TootParser, **kwargs), bench(PerFragmentParser, **kwargs)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Micro-benchmark for IdDict lookups.
+
+Fills an IdDict with an increasing number of toot IDs and times to_local()
+and to_global() for IDs that are already mapped.  Lookup time should stay
+flat as the number of entries grows.
+
+    python benchmarks/bench_iddict.py
+"""
+import random
+import timeit
+
+from tootstream.toot import IdDict
+
+SIZES = (1000, 10000, 100000, 1000000)
+LOOKUPS = 100000
+
+
+def bench(entries):
+    ids = IdDict(size=entries * 2)
+    global_ids = [str(109000000000000000 + i) for i in range(entries)]
+    for global_id in global_ids:
+        ids.to_local(global_id)
+
+    sample = random.choices(global_ids, k=LOOKUPS)
+    local_sample = [ids.to_local(global_id) for global_id in sample]
+
+    to_local = timeit.timeit(lambda: [ids.to_local(g) for g in sample], number=1)
+    to_global = timeit.timeit(
+        lambda: [ids.to_global(l) for l in local_sample], number=1
+    )
+    return to_local / LOOKUPS * 1e9, to_global / LOOKUPS * 1e9
+
+
+def main():
+    print("{:>10} {:>16} {:>16}".format("entries", "to_local (ns)", "to_global (ns)"))
+    for entries in SIZES:
+        to_local, to_global = bench(entries)
+        print("{:>10} {:>16.0f} {:>16.0f}".format(entries, to_local, to_global))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark for the time it takes to import tootstream.
+
+Imports tootstream.toot in a fresh interpreter with ``-X importtime`` a few
+times and reports the best run, the modules that took longest, and any
+module that should only be imported when it is used.  Exits with status 1
+if the import takes longer than the budget or imports one of those modules,
+so it can be tracked in CI.
+
+    python benchmarks/bench_import.py [budget in ms]
+"""
+import subprocess
+import sys
+
+MODULE = "tootstream.toot"
+BUDGET_MS = 250
+RUNS = 5
+TOP = 10
+
+# Imported on first use; none of these should load at startup
+LAZY = ("pkg_resources", "emoji", "humanize", "pytimeparse", "webbrowser", "websocket")
+
+
+def import_times():
+    """Import MODULE once and return {module: (self µs, cumulative µs)}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + MODULE],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            own, cumulative = int(fields[0]), int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+        times[fields[2].strip()] = (own, cumulative)
+    return times
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+    # the first run compiles and caches bytecode
+    import_times()
+    runs = [import_times() for _ in range(RUNS)]
+    best = min(runs, key=lambda times: times[MODULE][1])
+    total = best[MODULE][1] / 1e3
+
+    print("import {}: {:.1f} ms (budget {:.0f} ms)".format(MODULE, total, budget))
+    print()
+    print("{:<40} {:>10} {:>12}".format("slowest modules", "self (ms)", "total (ms)"))
+    slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (own, cumulative) in slowest[:TOP]:
+        print("{:<40} {:>10.1f} {:>12.1f}".format(name, own / 1e3, cumulative / 1e3))
+
+    loaded = [name for name in LAZY if name in best]
+    if loaded:
+        print()
+        print("imported at startup but should be lazy: " + ", ".join(loaded))
+    if loaded or total > budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
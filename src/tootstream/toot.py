@@ -1,28 +1,44 @@
 import sys
+import atexit
 import datetime
+import io
 import os.path
 import re
 import configparser
+import copy
 import random
 import readline
 import bisect
+import functools
 import shutil
+import threading
+import time
 from collections import OrderedDict
-import webbrowser
-import dateutil
+from concurrent.futures import Future, ThreadPoolExecutor
 
-# Get the version of Tootstream
-import pkg_resources  # part of setuptools
 import click
-from tootstream.toot_parser import TootParser
-from mastodon import Mastodon, StreamListener
+from tootstream.toot_parser import TootParser, emoji_unicode_to_shortcodes
+from tootstream.toot_cache import StatusCache, dump_status, load_status
+from tootstream.toot_following import FollowingIndex, sync_following
+from tootstream.toot_ids import IdFile
+from tootstream.toot_search import SearchIndex
+from tootstream.toot_session import SessionSnapshot
+from tootstream.toot_store import TimelineStore, fill_gaps, sync_timeline
+from tootstream.toot_stream import (
+    OVERFLOW_POLICIES,
+    MultiplexStream,
+    StreamQueue,
+    StreamRenderer,
+    Subscription,
+)
+from mastodon import Mastodon
+from mastodon import MastodonAPIError, MastodonRatelimitError
 from colored import fg, bg, attr, stylize
-import humanize
-import emoji
-import pytimeparse
-
 
-version = pkg_resources.require("tootstream")[0].version
+# Modules that only some commands need (webbrowser, humanize, pytimeparse,
+# and emoji and websocket in the helper modules) are imported where they
+# are used, so starting up doesn't wait for them.  See
+# benchmarks/bench_import.py.
 
 # placeholder variable for converting emoji to shortcodes until we get it in config
 convert_emoji_to_shortcode = False
@@ -30,9 +46,23 @@ convert_emoji_to_shortcode = False
 # placeholder variable for showing media links until we get it in config
 show_media_links = True
 
-# Flag for whether we're streaming or not
+# Flag for whether a stream runs in the foreground ('stream <timeline>'),
+# which owns the terminal.  Streams added with 'stream add' don't count.
 is_streaming = False
 
+# Streamed toots wait in a queue of this size for the renderer, which
+# writes to the terminal at most stream_fps times a second.  See
+# toot_stream.OVERFLOW_POLICIES for what happens when the queue is full.
+# With ndjson output the default is "block", so no toot goes missing.
+stream_queue_size = 500
+stream_overflow = "summarize"
+stream_fps = 10
+
+# "text" for the terminal, or "ndjson" to print toots, notifications and
+# users as one JSON object per line, unformatted, for other programs to read
+OUTPUT_FORMATS = ("text", "ndjson")
+output_format = "text"
+
 # Looks best with black background.
 # TODO: Set color list in config file
 COLORS = list(range(19, 231))
@@ -67,70 +97,631 @@ GLYPHS = {
     "unknown": "\U0001f34d",
 }
 
+# Most requests made at once by commands that act on several toots
+BATCH_WORKERS = 4
+MAX_BATCH_WORKERS = 16
+# How often a rate limited request is retried, and the first back off delay
+BATCH_RETRIES = 5
+BATCH_BACKOFF = 2
+# Largest ID range (e.g. 'fav 3-12') a command accepts
+MAX_ID_RANGE = 200
+# Page size used when syncing timelines into the local store (the most
+# Mastodon allows), and the number of toots shown from it by default
+SYNC_PAGE_SIZE = 40
+STORED_PAGE_SIZE = 20
+
 # reserved config sections (disallowed as profile names)
 RESERVED = ("theme", "global")
 
 
 class AlreadyPrintedException(Exception):
-    """An exception that has already been shown to the user, so doesn't need to be printed again."""
+    """An exception that has already been shown to the user, so doesn't need to be printed again.
+
+    Commands raise it after printing an error so that batch mode counts them
+    as failed."""
 
     pass
 
 
 class IdDict:
     """Represents a mapping of local (tootstream) ID's to global
-    (mastodon) IDs."""
-
-    def __init__(self):
-        self._map = []
+    (mastodon) IDs.
+
+    Local IDs are handed out in increasing order and are never reused, so an
+    ID that is still on screen can't start pointing at a different toot.
+
+    Only about `size` mappings are retained.  They are split into a young and
+    an old generation; using a mapping moves it into the young generation and
+    once that is full the old generation is forgotten.  IDs that were shown
+    or used recently therefore stay valid.
+
+    After open() every mapping is also appended to an IdFile, so local IDs
+    keep pointing at the same toots after a restart."""
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._next_id = 0
+        self._file = None
+        self._lock = threading.Lock()
+        # global -> local and local -> global for each generation
+        self._young = {}
+        self._young_local = {}
+        self._old = {}
+        self._old_local = {}
+
+    def open(self, path):
+        """Load and persist mappings using the ID file at path."""
+        self._file = IdFile(path)
+        recent = self._file.recent(max(self.size // 2, 1))
+        self._young_local.update(recent)
+        self._young.update((global_id, local_id) for local_id, global_id in recent)
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
+
+    def _promote(self, global_id, local_id):
+        """Put a mapping in the young generation, aging the generations
+        when it is full."""
+        if len(self._young) >= max(self.size // 2, 1):
+            self._old = self._young
+            self._old_local = self._young_local
+            self._young = {}
+            self._young_local = {}
+        self._young[global_id] = local_id
+        self._young_local[local_id] = global_id
 
     def to_local(self, global_id):
         """Returns the local ID for a global ID"""
+        # Mastodon.py may hand us ints or strings; the file only has strings
+        global_id = str(global_id)
+        with self._lock:
+            local_id = self._young.get(global_id)
+            if local_id is not None:
+                return local_id
+
+            local_id = self._old.pop(global_id, None)
+            if local_id is not None:
+                del self._old_local[local_id]
+            elif self._file is not None:
+                # the file decides, as other processes may append to it
+                local_id = self._file.append(global_id)
+            else:
+                local_id = self._next_id
+                self._next_id += 1
+            self._promote(global_id, local_id)
+            return local_id
+
+    def _lookup(self, local_id):
+        with self._lock:
+            global_id = self._young_local.get(local_id)
+            if global_id is not None:
+                return global_id
+            global_id = self._old_local.pop(local_id, None)
+            if global_id is not None:
+                del self._old[global_id]
+                self._promote(global_id, local_id)
+                return global_id
+            # an older ID, possibly from a previous session
+            if self._file is not None:
+                return self._file.get(local_id)
+            return None
+
+    def lookup(self, local_id):
+        """Returns the global ID for a local ID, or None if ID is invalid."""
         try:
-            return self._map.index(global_id)
+            return self._lookup(int(local_id))
         except ValueError:
-            self._map.append(global_id)
-            return len(self._map) - 1
+            return None
 
     def to_global(self, local_id):
         """Returns the global ID for a local ID, or None if ID is invalid.
         Also prints an error message"""
-        try:
-            local_id = int(local_id)
-            return self._map[local_id]
-        except Exception:
+        global_id = self.lookup(local_id)
+        if global_id is None:
             cprint("Invalid ID.", fg("red"))
+        return global_id
+
+
+class CredentialsCache:
+    """Keeps our own account (from account_verify_credentials) for the
+    session so it isn't fetched again for every listing and post.
+
+    The account is fetched again once it is older than `ttl` seconds, when
+    a refresh is requested, or after invalidate() was called because we
+    changed something on the account.  Counts we know the change of, like
+    statuses_count after posting, are updated with adjust() instead."""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._user = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, mastodon, refresh=False):
+        """Returns our account, fetching it if needed."""
+        with self._lock:
+            expired = time.monotonic() - self._fetched_at > self.ttl
+            if refresh or expired or self._user is None:
+                self._user = mastodon.account_verify_credentials()
+                self._fetched_at = time.monotonic()
+            return self._user
+
+    def seed(self, user):
+        """Use a stored copy of our account until it is fetched again."""
+        with self._lock:
+            self._user = user
+            self._fetched_at = time.monotonic()
+
+    def invalidate(self):
+        """Fetch the account again the next time it is needed."""
+        with self._lock:
+            self._user = None
+
+    def adjust(self, field, delta):
+        """Add delta to a count on the stored account."""
+        with self._lock:
+            if self._user is None or field not in self._user:
+                return
+            # the stored account may be shared, e.g. with the session snapshot
+            user = copy.copy(self._user)
+            user[field] += delta
+            self._user = user
+
+
+class PagePrefetcher:
+    """Fetches the page after the one on screen in the background, so
+    'next' usually doesn't have to wait for the server.
+
+    Only the page for the current context is prefetched: starting a new
+    prefetch discards the previous one.  No new prefetch is started while
+    `max_in_flight` requests (including discarded ones) are still running.
+    Nothing is prefetched while `enabled` is False."""
+
+    def __init__(self, max_in_flight=2):
+        self.max_in_flight = max_in_flight
+        self.enabled = True
+        self._in_flight = 0
+        self._page = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    def start(self, mastodon, page):
+        """Start fetching the page after page, discarding any earlier
+        prefetch."""
+        with self._lock:
+            self._page = None
+            self._future = None
+            if not (page and self.enabled) or self._in_flight >= self.max_in_flight:
+                return
+            self._in_flight += 1
+            self._page = page
+            self._future = future = Future()
+
+        def run():
+            try:
+                future.set_result(next_page(mastodon, page))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+        # daemon, so a slow request can't hold up quitting
+        threading.Thread(target=run, daemon=True).start()
+
+    def cancel(self):
+        """Discard the current prefetch."""
+        with self._lock:
+            self._page = None
+            self._future = None
+
+    def take(self, mastodon, page):
+        """Returns the page after page, waiting for the prefetch if it is
+        for this page or else fetching it now."""
+        with self._lock:
+            future = self._future if self._page is page else None
+            self._page = None
+            self._future = None
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                # try again in the foreground so errors are reported
+                pass
+        return next_page(mastodon, page)
+
+
+class PageHistory:
+    """Remembers the pages of results visited in each context so 'next' and
+    'prev' can go back to them without asking the server.
+
+    Each page is kept together with a function that fetches it again, used
+    by 'refresh'.  At most `size` pages are kept per context; moving past
+    either end drops the page furthest away on the other side.  The pages
+    of the last `contexts` contexts are kept, so after going back to one
+    the pages seen there before are still remembered."""
+
+    def __init__(self, size=10, contexts=10):
+        self.size = size
+        self.contexts = contexts
+        self.context = None
+        # (page, loader), newest first as returned by the server
+        self._entries = []
+        self._pos = -1
+        # the loader of the page the context was entered with
+        self._first = None
+        # context -> (entries, pos, first) of the other contexts
+        self._saved = OrderedDict()
+
+    @property
+    def at_end(self):
+        """True when there is no remembered page after the current one."""
+        return self._pos == len(self._entries) - 1
+
+    def reset(self, context, page, loader):
+        """Enter context with page, just loaded with loader, as the current
+        page.
+
+        If context was visited before, page takes the place of the page it
+        was entered with then.  The pages after it are still remembered;
+        those before it are newer than that page was, so page supersedes
+        them."""
+        if context == self.context:
+            entries, first = self._entries, self._first
+        else:
+            if self.context is not None:
+                self._saved[self.context] = (self._entries, self._pos, self._first)
+                self._saved.move_to_end(self.context)
+                while len(self._saved) > self.contexts:
+                    self._saved.popitem(last=False)
+            entries, _, first = self._saved.pop(context, ([], -1, None))
+        loaders = [entry_loader for _, entry_loader in entries]
+        if first in loaders:
+            entries = entries[loaders.index(first) :]
+            entries[0] = (page, loader)
+        else:
+            entries = [(page, loader)]
+        self.context = context
+        self._entries = entries
+        self._pos = 0
+        self._first = loader
+
+    def forward(self):
+        """Move to the remembered page after the current one and return it,
+        or None if there isn't one."""
+        if self.at_end:
+            return None
+        self._pos += 1
+        return self._entries[self._pos][0]
+
+    def back(self):
+        """Move to the remembered page before the current one and return it,
+        or None if there isn't one."""
+        if self._pos <= 0:
+            return None
+        self._pos -= 1
+        return self._entries[self._pos][0]
+
+    def push_next(self, page, loader):
+        """Add page after the current page and make it current."""
+        del self._entries[self._pos + 1 :]
+        self._entries.append((page, loader))
+        if len(self._entries) > self.size:
+            del self._entries[0]
+        self._pos = len(self._entries) - 1
+
+    def push_prev(self, page, loader):
+        """Add page before the current page and make it current."""
+        del self._entries[: self._pos]
+        self._entries.insert(0, (page, loader))
+        del self._entries[self.size :]
+        self._pos = 0
+
+    def reload(self):
+        """Fetch the current page again and return it.  Pages after it may
+        have changed as well, so they are forgotten.  A page with a reload()
+        method (StoredPage) fetches itself again; others use their loader."""
+        if self._pos < 0:
             return None
+        page, loader = self._entries[self._pos]
+        page = page.reload() if hasattr(page, "reload") else loader()
+        self._entries[self._pos] = (page, loader)
+        del self._entries[self._pos + 1 :]
+        return page
 
 
 def redisplay_prompt():
+    if output_format == "ndjson":
+        # readline draws on standard output, which only gets JSON
+        return
     print(readline.get_line_buffer(), end="", flush=True)
     readline.redisplay()
 
 
-class TootListener(StreamListener):
-    def on_update(self, status):
-        print()
-        printToot(status)
-        print()
+class StreamManager:
+    """Runs the streams started with 'stream'.
+
+    All subscriptions share one websocket (see MultiplexStream).  Streamed
+    toots go through a bounded StreamQueue to a StreamRenderer thread, so
+    the stream reader never waits for the terminal (unless the queue's
+    overflow policy is 'block').  The connection, queue and renderer are
+    created with the first subscription and stopped with the last one.
+
+    After a reconnect, the toots each stream missed while disconnected are
+    fetched from its timeline (at most `backfill_pages` pages) and shown
+    before the live ones.  Toots shown already are skipped."""
+
+    def __init__(self, backfill_pages=10):
+        self.backfill_pages = backfill_pages
+        self.mastodon = None
+        self.stream = None
+        self.queue = None
+        self.renderer = None
+        # label of the stream shown by 'stream <timeline>', if any
+        self.foreground = None
+
+    @property
+    def subscriptions(self):
+        if self.stream is None:
+            return []
+        return self.stream.subscriptions
+
+    def add(self, mastodon, subscription):
+        """Start streaming subscription, connecting if needed."""
+        if self.stream is not None:
+            self.stream.subscribe(subscription)
+            return
+        self.mastodon = mastodon
+        stream = MultiplexStream(
+            streaming_url(mastodon),
+            mastodon.access_token,
+            self.on_event,
+            on_error=self.on_error,
+            on_connect=self.on_connect,
+        )
+        stream.subscribe(subscription)
+        self.queue = StreamQueue(stream_queue_size, stream_overflow)
+        self.renderer = StreamRenderer(self.queue, show_streamed, stream_fps)
+        self.renderer.start()
+        self.stream = stream
+        stream.start()
+
+    def remove(self, label):
+        """Stop streaming label.  Returns the removed subscription or None.
+        Removing the last subscription closes the connection."""
+        if self.stream is None:
+            return None
+        subscription = self.stream.unsubscribe(label)
+        if not self.stream.subscriptions:
+            self.stop()
+        return subscription
+
+    def stop(self):
+        """Close the connection and show what is still queued."""
+        if self.stream is None:
+            return
+        self.stream.close()
+        self.renderer.stop()
+        cprint(
+            "Received {} toots, {} dropped (queue peaked at {} of {}).".format(
+                self.queue.received,
+                self.queue.dropped,
+                self.queue.max_depth,
+                self.queue.maxsize,
+            ),
+            fg("magenta"),
+        )
+        self.stream = self.queue = self.renderer = None
+
+    def on_event(self, subscription, event, payload):
+        if event == "update":
+            self.deliver(subscription, load_status(payload))
+        elif event == "status.update":
+            # an edit: show it again even though the ID has been seen
+            status = load_status(payload)
+            subscription.mark_seen(status["id"])
+            subscription.received += 1
+            self.queue.put((subscription.label, status))
+        elif event == "delete":
+            STATUS_CACHE.discard(payload)
+
+    def deliver(self, subscription, status):
+        if subscription.mark_seen(status["id"]):
+            subscription.received += 1
+            self.queue.put((subscription.label, status))
+
+    def on_connect(self, connects):
+        if connects == 1:
+            return
+        for subscription in self.stream.subscriptions:
+            if subscription.last_id is None:
+                continue
+            try:
+                self.backfill(subscription)
+            except Exception as e:
+                cprint(
+                    "Unable to fetch toots missed by {}: {}".format(
+                        subscription.label, e
+                    ),
+                    fg("red"),
+                )
+
+    def backfill(self, subscription):
+        """Fetch and deliver the toots newer than the last one seen on
+        subscription, oldest first."""
+        fetch = stream_timeline(self.mastodon, subscription)
+        for _ in range(self.backfill_pages):
+            page = fetch(min_id=subscription.last_id, limit=40)
+            if not page:
+                return
+            # pages are newest first, also when paging with min_id
+            for status in reversed(page):
+                self.deliver(subscription, status)
+
+    def on_error(self, e):
+        with output_lock:
+            cprint(
+                "\nStream connection problem ({}), reconnecting...".format(e), fg("red")
+            )
+            redisplay_prompt()
+
+
+class AutoSync:
+    """Syncs the stored timelines into the local store every `interval`
+    seconds on a background thread (see 'sync every')."""
+
+    def __init__(self):
+        self.interval = None
+        self._stop = None
+
+    def start(self, mastodon, interval):
+        self.stop()
+        self.interval = interval
+        self._stop = stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    sync_timelines(mastodon)
+                except Exception as e:
+                    with output_lock:
+                        cprint("\nBackground sync failed: {}".format(e), fg("red"))
+                        redisplay_prompt()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        self.interval = None
+
+
+def streaming_url(mastodon):
+    """Returns the websocket URL of the instance's streaming API."""
+    try:
+        url = mastodon.instance()["urls"]["streaming_api"]
+    except Exception:
+        url = None
+    url = (url or mastodon.api_base_url).rstrip("/")
+    if url.startswith("https://"):
+        url = "wss://" + url[len("https://") :]
+    elif url.startswith("http://"):
+        url = "ws://" + url[len("http://") :]
+    return url + "/api/v1/streaming"
+
+
+def stream_subscription(mastodon, timeline):
+    """Returns the Subscription for a timeline given to 'stream'."""
+    if timeline == "home" or timeline == "":
+        return Subscription("home", "user")
+    if timeline == "fed" or timeline == "public":
+        return Subscription("fed", "public")
+    if timeline == "local":
+        return Subscription("local", "public:local")
+    if timeline.startswith("list"):
+        name = timeline[len("list") :].strip()
+        if not name:
+            raise ValueError("list stream must have a list ID.")
+        item = get_list_id(mastodon, name)
+        return Subscription("list:" + name, "list", {"list": str(item)})
+    if timeline.startswith("#") and len(timeline) > 1:
+        return Subscription(timeline, "hashtag", {"tag": timeline[1:]})
+    raise ValueError(
+        "Only 'home', 'fed', 'local', 'list', and '#hashtag' streams are supported."
+    )
+
+
+def stream_timeline(mastodon, subscription):
+    """Returns the Mastodon method fetching the timeline a subscription
+    streams, taking min_id and limit."""
+    if subscription.stream == "user":
+        return mastodon.timeline_home
+    if subscription.stream == "public":
+        return mastodon.timeline_public
+    if subscription.stream == "public:local":
+        return mastodon.timeline_local
+    if subscription.stream == "hashtag":
+        return functools.partial(mastodon.timeline_hashtag, subscription.params["tag"])
+    if subscription.stream == "list":
+        return functools.partial(mastodon.timeline_list, subscription.params["list"])
+    raise ValueError("Unknown stream: {}".format(subscription.stream))
+
+
+def show_streamed(events, skipped):
+    """Render a batch of streamed (label, toot) pairs and write them to the
+    terminal at once."""
+    STATUS_CACHE.put_many(status for label, status in events)
+    if output_format == "ndjson":
+        if skipped:
+            cprint("{} toots skipped".format(skipped), fg("yellow"))
+        write_ndjson(status for label, status in events)
+        return
+    out = []
+    if skipped:
+        out.append(
+            "\n" + stylize("  {} toots skipped".format(skipped), fg("yellow")) + "\n"
+        )
+    for label, status in events:
+        out.append("\n" + stylize("  [{}]".format(label), fg("magenta")) + "\n")
+        try:
+            out.append(format_toot(status) + "\n\n\n")
+        except Exception as e:
+            out.append(stylize("Unable to show a toot: {}\n".format(e), fg("red")))
+    with output_lock:
+        sys.stdout.write("".join(out))
+        sys.stdout.flush()
         redisplay_prompt()
 
 
 IDS = IdDict()
 
+STATUS_CACHE = StatusCache()
+
+CREDENTIALS = CredentialsCache()
+
 LAST_PAGE = None
 LAST_CONTEXT = None
+PREFETCHER = PagePrefetcher()
+PAGES = PageHistory()
+# (note ID, type) of the notifications shown by the last 'note'
+LAST_NOTES = []
 
 # Get the current width of the terminal
 terminal_size = shutil.get_terminal_size((80, 20))
-toot_parser = TootParser(
-    indent="  ",
-    width=int(terminal_size.columns) - 2,
-    convert_emoji_to_unicode=False,
-    convert_emoji_to_shortcode=convert_emoji_to_shortcode,
-)
 
-toot_listener = TootListener()
+# The stream listener renders toots on its own thread while commands run on
+# the main thread.  Each thread gets its own parser, and anything written to
+# the terminal goes through the output lock so toots don't interleave.
+_thread_state = threading.local()
+output_lock = threading.RLock()
+
+
+def get_parser():
+    """Returns the TootParser for the current thread."""
+    parser = getattr(_thread_state, "parser", None)
+    if parser is None:
+        parser = TootParser(
+            indent="  ",
+            width=int(terminal_size.columns) - 2,
+            convert_emoji_to_unicode=False,
+            convert_emoji_to_shortcode=convert_emoji_to_shortcode,
+        )
+        _thread_state.parser = parser
+    return parser
+
+
+STREAMS = StreamManager()
+
+STORE = TimelineStore()
+
+SEARCH = SearchIndex()
+
+SESSION = SessionSnapshot()
+
+FOLLOWING = FollowingIndex()
+
+AUTO_SYNC = AutoSync()
 
 
 #####################################
@@ -149,6 +740,202 @@ def find_original_toot_id(toot):
     return IDS.to_local(original_toot_id)
 
 
+def get_status(mastodon, status_id):
+    """Returns a status by global ID, asking the server only if we haven't
+    seen it yet."""
+    status = STATUS_CACHE.get(status_id)
+    if status is None:
+        status = mastodon.status(status_id)
+        STATUS_CACHE.put(status)
+    return status
+
+
+def run_in_background(description, func, *args):
+    """Call func(*args) on a daemon thread, for work nobody waits for.  A
+    failure is reported as "Unable to <description>" above the prompt."""
+
+    def run():
+        try:
+            func(*args)
+        except Exception as e:
+            with output_lock:
+                cprint("\nUnable to {}: {}".format(description, e), fg("red"))
+                redisplay_prompt()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+@functools.lru_cache(maxsize=None)
+def get_version():
+    """Returns the installed version of tootstream."""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("tootstream")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def open_url(url):
+    """Open url in the web browser."""
+    import webbrowser
+
+    webbrowser.open(url)
+
+
+def get_state_path(config, profile, suffix):
+    """Returns the path of a per-profile state file next to the config file."""
+    configdir = os.path.dirname(os.path.expanduser(config))
+    return os.path.join(configdir, profile + suffix)
+
+
+def set_page(mastodon, page, context):
+    """Make page the current page of results for next/prev and start
+    prefetching the page after it unless that one is remembered already."""
+    global LAST_PAGE, LAST_CONTEXT
+    LAST_PAGE = page
+    LAST_CONTEXT = context
+    if PAGES.at_end:
+        PREFETCHER.start(mastodon, page)
+    else:
+        PREFETCHER.cancel()
+
+
+class StoredPage(list):
+    """A page of toots read from the local timeline store, with the cursor
+    it was read with: the toots older than max_id, newer than min_id, or
+    the newest ones."""
+
+    def __init__(self, statuses, timeline, fetch, limit, max_id=None, min_id=None):
+        super().__init__(statuses)
+        self.timeline = timeline
+        self.fetch = fetch
+        self.limit = limit
+        self.max_id = max_id
+        self.min_id = min_id
+
+    def reload(self):
+        """Fetch the toots of this page from the server again, replacing the
+        stored ones, and return the page read back from the store."""
+        page = self.fetch(max_id=self.max_id, min_id=self.min_id, limit=self.limit)
+        STORE.replace(self.timeline, page or [], self.max_id, self.min_id, self)
+        if self.min_id is None:
+            return read_store(self.timeline, self.fetch, self.limit, self.max_id)
+        statuses, complete = STORE.newer(self.timeline, self.min_id, self.limit)
+        if not statuses:
+            return None
+        return StoredPage(
+            statuses, self.timeline, self.fetch, self.limit, min_id=self.min_id
+        )
+
+    def older(self):
+        return read_store(self.timeline, self.fetch, self.limit, self[-1]["id"])
+
+    def newer(self):
+        """Returns the page of newer toots, fetching them if the store
+        doesn't have all of them."""
+        min_id = self[0]["id"]
+        statuses, complete = STORE.newer(self.timeline, min_id, self.limit)
+        if not complete:
+            above = statuses[0]["id"] if statuses else min_id
+            STORE.add_newer(
+                self.timeline, self.fetch(min_id=above, limit=SYNC_PAGE_SIZE) or []
+            )
+            statuses, complete = STORE.newer(self.timeline, min_id, self.limit)
+        if not statuses:
+            return None
+        return StoredPage(
+            statuses, self.timeline, self.fetch, self.limit, min_id=min_id
+        )
+
+
+def read_store(timeline, fetch, limit, max_id=None):
+    """Returns the page of stored toots older than max_id (or the newest
+    ones), first fetching what is missing from the store."""
+    statuses, complete = STORE.older(timeline, max_id, limit)
+    if not complete:
+        below = statuses[-1]["id"] if statuses else max_id
+        page = fetch(max_id=below, limit=SYNC_PAGE_SIZE) or []
+        STORE.add_older(timeline, page, below, SYNC_PAGE_SIZE)
+        statuses, complete = STORE.older(timeline, max_id, limit)
+    if not statuses:
+        return None
+    return StoredPage(statuses, timeline, fetch, limit, max_id=max_id)
+
+
+def stored_timeline(mastodon, timeline):
+    """Returns the Mastodon method fetching a timeline that can be stored:
+    home, local or list:<list id>."""
+    if timeline == "home":
+        return mastodon.timeline_home
+    if timeline == "local":
+        return mastodon.timeline_local
+    if timeline.startswith("list:"):
+        return functools.partial(mastodon.timeline_list, timeline[len("list:") :])
+    raise ValueError("Unknown timeline: {}".format(timeline))
+
+
+def timeline_loader(mastodon, timeline, limit=None):
+    """Returns a function fetching the first page of a timeline.  With the
+    local store open, new toots are synced into the store and the page is
+    read from there."""
+    fetch = stored_timeline(mastodon, timeline)
+    if not STORE.is_open:
+        return lambda: fetch(limit=limit)
+
+    def load():
+        sync_timeline(STORE, timeline, fetch, SYNC_PAGE_SIZE)
+        return read_store(timeline, fetch, limit or STORED_PAGE_SIZE)
+
+    return load
+
+
+def sync_timelines(mastodon, timelines=None):
+    """Sync timelines (by default all stored ones and home) into the local
+    store and fill gaps in them.  Returns (timeline, new toots) pairs."""
+    if timelines is None:
+        timelines = ["home"] + [t for t in STORE.timelines() if t != "home"]
+    results = []
+    for timeline in timelines:
+        fetch = stored_timeline(mastodon, timeline)
+        added = sync_timeline(STORE, timeline, fetch, SYNC_PAGE_SIZE)
+        fill_gaps(STORE, timeline, fetch, SYNC_PAGE_SIZE)
+        results.append((timeline, added))
+    return results
+
+
+def next_page(mastodon, page):
+    """Returns the page of results after page, or None."""
+    if isinstance(page, StoredPage):
+        return page.older()
+    return mastodon.fetch_next(page)
+
+
+def previous_page(mastodon, page):
+    """Returns the page of results before page, or None."""
+    if isinstance(page, StoredPage):
+        return page.newer()
+    return mastodon.fetch_previous(page)
+
+
+def load_page(mastodon, context, loader):
+    """Fetch the first page of a new context with loader and make it the
+    current page.
+
+    Commands running concurrently in batch mode only record the page; it is
+    made current once they are done (see run_script())."""
+    page = loader()
+    pages = getattr(_thread_state, "pages", None)
+    if pages is not None:
+        pages.append((context, page, loader))
+        return page
+    PAGES.reset(context, page, loader)
+    set_page(mastodon, page, context)
+    return page
+
+
 def rest_to_list(rest):
     rest = ",".join(rest.split())
     rest = rest.replace(",,", ",")
@@ -156,6 +943,93 @@ def rest_to_list(rest):
     return rest
 
 
+def rest_to_ids(rest):
+    """Expand a list of IDs and ID ranges, e.g. '3 5-7,9', into a list of
+    IDs."""
+    ids = []
+    for item in rest_to_list(rest):
+        start, sep, end = item.partition("-")
+        if sep and start.isdigit() and end.isdigit():
+            start, end = int(start), int(end)
+            if abs(end - start) >= MAX_ID_RANGE:
+                raise ValueError(
+                    f"  ID range {item} is too large (at most {MAX_ID_RANGE} IDs)."
+                )
+            step = 1 if end >= start else -1
+            ids.extend(str(i) for i in range(start, end + step, step))
+        elif item:
+            ids.append(item)
+    return ids
+
+
+def is_rate_limited(error):
+    """Returns whether an API error means we hit the rate limit (HTTP 429)."""
+    if isinstance(error, MastodonRatelimitError):
+        return True
+    return isinstance(error, MastodonAPIError) and 429 in error.args
+
+
+def run_batch(mastodon, func, items, workers=BATCH_WORKERS, progress=None):
+    """Call func(item) for every item on a bounded thread pool.
+
+    Returns a list of (item, result, exception) tuples in the order of
+    items; exception is None for calls that succeeded.  Fewer workers are
+    used when we are close to the API rate limit, and when a call is rate
+    limited all workers back off (doubling the delay each time) before
+    retrying it.
+
+    progress, if given, is called with (done, total) after each item."""
+    backoff = {"until": 0.0}
+    done = [0]
+    lock = threading.Lock()
+
+    def call(item):
+        delay = BATCH_BACKOFF
+        for attempt in range(BATCH_RETRIES + 1):
+            wait = backoff["until"] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                result = (item, func(item), None)
+            except Exception as e:
+                if is_rate_limited(e) and attempt < BATCH_RETRIES:
+                    with lock:
+                        backoff["until"] = max(
+                            backoff["until"], time.monotonic() + delay
+                        )
+                    delay *= 2
+                    continue
+                result = (item, None, e)
+            break
+        if progress is not None:
+            with lock:
+                done[0] += 1
+                progress(done[0], len(items))
+        return result
+
+    remaining = getattr(mastodon, "ratelimit_remaining", None)
+    if isinstance(remaining, int):
+        workers = min(workers, max(remaining // 10, 1))
+    workers = max(min(workers, len(items)), 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(call, items))
+
+
+def print_progress(label):
+    """Returns a progress callback for run_batch that keeps updating a
+    single line."""
+
+    def progress(done, total):
+        tprint(
+            f"\r  {label}: {done}/{total}",
+            end="\n" if done == total else "",
+            flush=True,
+        )
+
+    return progress
+
+
 def rest_limit(rest):
     rest_list = rest_to_list(rest)
     limit = None
@@ -176,7 +1050,8 @@ def update_prompt(username, context, profile):
 
 
 def list_support(mastodon, silent=False):
-    lists_available = mastodon.verify_minimum_version("2.1.0")
+    # the instance version is only fetched the first time
+    lists_available = mastodon.verify_minimum_version("2.1.0", cached=True)
     if lists_available is False and silent is False:
         cprint("List support is not available with this version of Mastodon", fg("red"))
     return lists_available
@@ -198,6 +1073,7 @@ def get_content(toot):
     html = toot.get("content")
     if html is None:
         return ""
+    toot_parser = get_parser()
     toot_parser.parse(html)
     return toot_parser.get_text()
 
@@ -215,6 +1091,7 @@ def get_media_attachments(toot):
         for media in toot.get("media_attachments"):
             description = media.get("description")
             if description:
+                toot_parser = get_parser()
                 toot_parser.reset()
                 toot_parser.handle_data(" " + nsfw + " " + description)
                 out.append(stylize(toot_parser.get_text(), fg("white")))
@@ -338,11 +1215,83 @@ def flaghandler_note(mastodon, rest):
     )
 
 
+class MediaUploads:
+    """Uploads media files in the background while the user keeps typing."""
+
+    def __init__(self, mastodon):
+        self._mastodon = mastodon
+        self._pool = ThreadPoolExecutor(max_workers=4)
+        self._uploads = []
+
+    def __len__(self):
+        return len(self._uploads)
+
+    def add(self, fname):
+        """Start uploading a file."""
+        future = self._pool.submit(self._mastodon.media_post, fname)
+        self._uploads.append((fname, future))
+
+    def wait(self):
+        """Wait for all uploads to finish.  Returns the uploaded media and
+        the names of the files that failed, reporting each failure."""
+        media = []
+        failed = []
+        tprint("Attaching files:")
+        for c, (fname, future) in enumerate(self._uploads, 1):
+            try:
+                media.append(future.result())
+            except Exception as e:
+                cprint(
+                    "{}: API error uploading file {}".format(type(e).__name__, fname),
+                    fg("red"),
+                )
+                failed.append(fname)
+            else:
+                tprint("    {}: {}".format(c, fname))
+        self._pool.shutdown()
+        return media, failed
+
+    def cancel(self):
+        """Stop uploading when the toot won't be posted, telling the user
+        about uploads that hadn't finished.  Does nothing after wait()."""
+        pending = [fname for fname, future in self._uploads if not future.done()]
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if pending:
+            cprint("Cancelled uploading {}".format(", ".join(pending)), fg("yellow"))
+
+
+def cancel_media_uploads(kwargs):
+    """Cancel the uploads started by flaghandler_tootreply, if any, when
+    the toot won't be posted."""
+    uploads = (kwargs or {}).get("media_ids")
+    if isinstance(uploads, MediaUploads):
+        uploads.cancel()
+
+
+def finish_media_uploads(kwargs):
+    """Wait for the uploads started by flaghandler_tootreply and put the
+    media in kwargs.  Returns False if the user doesn't want to post after
+    some uploads failed."""
+    uploads = kwargs.get("media_ids")
+    if not isinstance(uploads, MediaUploads):
+        return True
+
+    media, failed = uploads.wait()
+    kwargs["media_ids"] = media or None
+    if failed:
+        question = "Post with {} of {} files attached? [y/N]: "
+        post = read_input(question.format(len(media), len(uploads)))
+        return post.lower().startswith("y")
+    return True
+
+
 def flaghandler_tootreply(mastodon, rest):
-    """Parse input for flags and prompt user.  On success, returns
-    a tuple of the input string (minus flags) and a dict of keyword
-    arguments for Mastodon.status_post().  On failure, returns
-    (None, None)."""
+    """Parse input for flags and prompt user.  Returns a tuple of the
+    input string (minus flags) and a dict of keyword arguments for
+    Mastodon.status_post().
+
+    Media files are uploaded in the background; call finish_media_uploads()
+    on the keyword arguments before posting."""
 
     (rest, flags) = flaghandler(
         rest, False, {"v": "visibility", "c": "cw", "C": "noCW", "m": "media"}
@@ -350,7 +1299,7 @@ def flaghandler_tootreply(mastodon, rest):
 
     # if any flag is true, print a general usage message
     if True in flags.values():
-        print("Press Ctrl-C to abort and return to the main prompt.")
+        tprint("Press Ctrl-C to abort and return to the main prompt.")
 
     # initialize kwargs to default values
     kwargs = {
@@ -362,7 +1311,9 @@ def flaghandler_tootreply(mastodon, rest):
 
     # visibility flag
     if flags["visibility"]:
-        vis = input("Set visibility [(p)ublic/(u)nlisted/(pr)ivate/(d)irect/None]: ")
+        vis = read_input(
+            "Set visibility [(p)ublic/(u)nlisted/(pr)ivate/(d)irect/None]: "
+        )
         vis = vis.lower()
 
         # default case; pass on through
@@ -383,68 +1334,62 @@ def flaghandler_tootreply(mastodon, rest):
                 "error: only 'public', 'unlisted', 'private', 'direct' are allowed",
                 fg("red"),
             )
-            return (None, None)
+            raise AlreadyPrintedException
     # end vis
 
-    # cw/spoiler flag
     if flags["noCW"] and flags["cw"]:
         cprint("error: only one of -C and -c allowed", fg("red"))
-        return (None, None)
-    elif flags["noCW"]:
-        # unset
-        kwargs["spoiler_text"] = ""
-    elif flags["cw"]:
-        # prompt to set
-        cw = input("Set content warning [leave blank for none]: ")
-
-        # don't set if empty
-        if cw:
-            kwargs["spoiler_text"] = cw
-    # end cw
+        raise AlreadyPrintedException
 
     # media flag
-    media = []
+    # Each file starts uploading as soon as it's entered, the uploads are
+    # only waited for right before posting (see finish_media_uploads).
     if flags["media"]:
-        print("You can attach up to 4 files. A blank line will end filename input.")
-        count = 0
-        while count < 4:
-            fname = input("add file {}: ".format(count + 1))
-
-            # break on empty line
-            if not fname:
-                break
-
-            # expand paths and check file access
-            fname = os.path.expanduser(fname).strip()
-            if os.path.isfile(fname) and os.access(fname, os.R_OK):
-                media.append(fname)
-                count += 1
+        tprint("You can attach up to 4 files. A blank line will end filename input.")
+        uploads = MediaUploads(mastodon)
+        kwargs["media_ids"] = uploads
+    try:
+        if flags["media"]:
+            while len(uploads) < 4:
+                fname = read_input("add file {}: ".format(len(uploads) + 1))
+
+                # break on empty line
+                if not fname:
+                    break
+
+                # expand paths and check file access
+                fname = os.path.expanduser(fname).strip()
+                if os.path.isfile(fname) and os.access(fname, os.R_OK):
+                    uploads.add(fname)
+                else:
+                    raise Exception(f"error: cannot find file {fname}")
+
+            if len(uploads):
+                # prompt for sensitivity
+                nsfw = read_input("Mark sensitive media [y/N]: ")
+                nsfw = nsfw.lower()
+                if nsfw.startswith("y"):
+                    kwargs["sensitive"] = True
             else:
-                raise Exception(f"error: cannot find file {fname}")
-
-        # upload, verify
-        if count:
-            print("Attaching files:")
-            c = 1
-            kwargs["media_ids"] = []
-            for m in media:
-                try:
-                    kwargs["media_ids"].append(mastodon.media_post(m))
-                except Exception as e:
-                    cprint(
-                        "{}: API error uploading file {}".format(type(e).__name__, m),
-                        fg("red"),
-                    )
-                    return (None, None)
-                print("    {}: {}".format(c, m))
-                c += 1
-
-            # prompt for sensitivity
-            nsfw = input("Mark sensitive media [y/N]: ")
-            nsfw = nsfw.lower()
-            if nsfw.startswith("y"):
-                kwargs["sensitive"] = True
-    # end media
+                kwargs["media_ids"] = None
+        # end media
+
+        # cw/spoiler flag
+        if flags["noCW"]:
+            # unset
+            kwargs["spoiler_text"] = ""
+        elif flags["cw"]:
+            # prompt to set
+            cw = read_input("Set content warning [leave blank for none]: ")
+
+            # don't set if empty
+            if cw:
+                kwargs["spoiler_text"] = cw
+        # end cw
+    except BaseException:
+        # we won't get to post, so stop the uploads already started
+        cancel_media_uploads(kwargs)
+        raise
 
     return (rest, kwargs)
 
@@ -484,7 +1429,7 @@ def print_toots(
     if listing is None:
         cprint("No toots in current context.", fg("white") + bg("red"))
         return
-    user = mastodon.account_verify_credentials()
+    user = CREDENTIALS.get(mastodon)
     ctx = "" if ctx_name is None else " in {}".format(ctx_name)
 
     def say_error(*args, **kwargs):
@@ -493,6 +1438,12 @@ def print_toots(
             fg("white") + bg("red"),
         )
 
+    STATUS_CACHE.put_many(listing)
+
+    if output_format == "ndjson":
+        write_ndjson(reversed(listing) if sort_toots else listing)
+        return
+
     if sort_toots:
         toot_list = enumerate(reversed(listing))
     else:
@@ -508,7 +1459,7 @@ def print_toots(
             prompt = f"[@{username} {pos+1}/{len(listing)}{ctx}]: "
             command = None
             while command not in ["", "q"]:
-                command = input(prompt).split(" ", 1)
+                command = read_input(prompt).split(" ", 1)
 
                 try:
                     rest = command[1]
@@ -525,7 +1476,10 @@ def print_toots(
                             rest = str(find_original_toot_id(toot)) + " " + rest
                         if cmd_func.__argstr__.startswith("<user>"):
                             rest = "@" + toot["account"]["username"] + " " + rest
-                    cmd_func(mastodon, rest)
+                    try:
+                        cmd_func(mastodon, rest)
+                    except AlreadyPrintedException:
+                        pass
 
             if command == "q":
                 break
@@ -537,7 +1491,7 @@ def toot_visibility(mastodon, flag_visibility=None, parent_visibility=None):
     flags > parent (if not public) > account settings
     """
 
-    default_visibility = mastodon.account_verify_credentials()["source"]["privacy"]
+    default_visibility = CREDENTIALS.get(mastodon)["source"]["privacy"]
     if flag_visibility:
         return flag_visibility
 
@@ -551,30 +1505,178 @@ def toot_visibility(mastodon, flag_visibility=None, parent_visibility=None):
 ########     COMPLETION      ########
 #####################################
 
-completion_list = []
+class CompletionIndex:
+    """A sorted set of words (commands, usernames, list names) for tab
+    completion.
+
+    Words are kept in a sorted list so all completions for a prefix are
+    found with two binary searches.  Once more than `size` words have been
+    added the least recently added ones are evicted; pinned words such as
+    command names are never evicted."""
+
+    def __init__(self, size=20000):
+        self.size = size
+        self._words = []
+        # evictable words, least recently added first
+        self._recent = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, word):
+        return word in self._recent or word in self._pinned
+
+    def __len__(self):
+        return len(self._words)
+
+    def add(self, word, pinned=False):
+        """Add a word, ignoring duplicates."""
+        with self._lock:
+            if word in self._pinned:
+                return
+            if word in self._recent:
+                if pinned:
+                    del self._recent[word]
+                    self._pinned.add(word)
+                else:
+                    self._recent.move_to_end(word)
+                return
+
+            bisect.insort(self._words, word)
+            if pinned:
+                self._pinned.add(word)
+                return
+            self._recent[word] = None
+            while len(self._recent) > self.size:
+                oldest, _ = self._recent.popitem(last=False)
+                self._discard(oldest)
+
+    def remove(self, word):
+        """Remove a word if it is present."""
+        with self._lock:
+            if word in self._recent:
+                del self._recent[word]
+            elif word in self._pinned:
+                self._pinned.remove(word)
+            else:
+                return
+            self._discard(word)
+
+    def _discard(self, word):
+        i = bisect.bisect_left(self._words, word)
+        if i < len(self._words) and self._words[i] == word:
+            del self._words[i]
+
+    def complete(self, prefix):
+        """Returns all words starting with prefix, sorted."""
+        with self._lock:
+            lo = bisect.bisect_left(self._words, prefix)
+            if not prefix:
+                return self._words[lo:]
+            # the first string after every string starting with prefix
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            hi = bisect.bisect_left(self._words, upper, lo)
+            return self._words[lo:hi]
+
+
+completions = CompletionIndex()
+
+# readline asks for the matches one at a time, so keep them between calls
+_completion_matches = []
 
 
 def complete(text, state):
     """Return the state-th potential completion for the name-fragment, text"""
-    options = [name for name in completion_list if name.startswith(text)]
-    if state < len(options):
-        return options[state] + " "
+    global _completion_matches
+    if state == 0:
+        _completion_matches = completions.complete(text)
+    if state < len(_completion_matches):
+        return _completion_matches[state] + " "
     else:
         return None
 
 
 def completion_add(toot):
-    """Add usernames (original author, mentions, booster) co completion_list"""
+    """Add usernames (original author, mentions, booster) to completions"""
     if toot["reblog"]:
-        username = "@" + toot["reblog"]["account"]["acct"]
-        if username not in completion_list:
-            bisect.insort(completion_list, username)
-    username = "@" + toot["account"]["acct"]
-    if username not in completion_list:
-        bisect.insort(completion_list, username)
-    for user in ["@" + user["acct"] for user in toot["mentions"]]:
-        if user not in completion_list:
-            bisect.insort(completion_list, username)
+        completions.add("@" + toot["reblog"]["account"]["acct"])
+    completions.add("@" + toot["account"]["acct"])
+    for user in toot["mentions"]:
+        completions.add("@" + user["acct"])
+
+
+def complete_lists(mastodon):
+    """Add the names of our lists to completions and return them"""
+    if not list_support(mastodon, silent=True):
+        return []
+    titles = [i["title"] for i in mastodon.lists()]
+    for title in titles:
+        completions.add(title.lower(), pinned=True)
+    return titles
+
+
+def complete_following(mastodon, user):
+    """Add the first page of accounts we follow to completions"""
+    for i in mastodon.account_following(user["id"], limit=80):
+        completions.add("@" + i["acct"])
+
+
+def update_following(added, removed):
+    """Keep completions in line with the following index"""
+    for acct in added:
+        completions.add("@" + acct)
+    for acct in removed:
+        completions.remove("@" + acct)
+
+
+def restore_session():
+    """Set up the account and completions from the session snapshot and
+    the following index.  Returns our account, or None if the snapshot
+    doesn't have it."""
+    if FOLLOWING.is_open:
+        update_following(FOLLOWING.accts(), [])
+    user = SESSION.get("user")
+    if user is None:
+        return None
+    CREDENTIALS.seed(user)
+    for title in SESSION.get("lists", []):
+        completions.add(title.lower(), pinned=True)
+    return user
+
+
+def refresh_session(mastodon, user=None):
+    """Fetch what the session snapshot holds, update completions to match
+    and save it, then bring the following index up to date.  Fetches our
+    account again unless user is given."""
+    old_lists = SESSION.get("lists", [])
+
+    def fetch_lists():
+        # the client may have been created with the stored version
+        mastodon.retrieve_mastodon_version()
+        return complete_lists(mastodon)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        lists = pool.submit(fetch_lists)
+        if user is None:
+            user = CREDENTIALS.get(mastodon, refresh=True)
+        lists = lists.result()
+    for title in set(old_lists) - set(lists):
+        completions.remove(title.lower())
+    version = "{}.{}.{}".format(
+        mastodon.mastodon_major, mastodon.mastodon_minor, mastodon.mastodon_patch
+    )
+    SESSION.update(
+        instance=mastodon.api_base_url, user=user, version=version, lists=lists
+    )
+
+    if FOLLOWING.is_open:
+        sync_following(
+            FOLLOWING,
+            functools.partial(mastodon.account_following, user["id"]),
+            user.get("following_count"),
+            on_update=update_following,
+        )
+    else:
+        complete_following(mastodon, user)
 
 
 #####################################
@@ -667,10 +1769,10 @@ def login(instance, client_id, client_secret):
         api_base_url="https://" + instance,
     )
 
-    print("Click the link to authorize login.")
-    print(mastodon.auth_request_url(scopes=["read", "write", "follow"]))
-    print()
-    code = input("Enter the code you received >")
+    tprint("Click the link to authorize login.")
+    tprint(mastodon.auth_request_url(scopes=["read", "write", "follow"]))
+    tprint()
+    code = read_input("Enter the code you received >")
 
     return mastodon.log_in(code=code, scopes=["read", "write", "follow"])
 
@@ -710,7 +1812,7 @@ def get_or_input_profile(config, profile, instance=None):
             "  Which instance would you like to connect to? eg: 'mastodon.social'",
             fg("blue"),
         )
-        instance = input("  Instance: ")
+        instance = read_input("  Instance: ")
 
     client_id = None
     if "client_id" in config[profile]:
@@ -754,7 +1856,38 @@ def get_or_input_profile(config, profile, instance=None):
 ######## OUTPUT FUNCTIONS    ########
 #####################################
 def cprint(text, style, end="\n"):
-    print(stylize(text, style), end=end)
+    with output_lock:
+        if output_format == "ndjson":
+            # keep messages out of the JSON
+            print(text, end=end, file=sys.stderr)
+        else:
+            print(stylize(text, style), end=end)
+
+
+def tprint(*args, **kwargs):
+    """print() holding the output lock, so the text can't end up in the
+    middle of a toot written by a background stream."""
+    with output_lock:
+        if output_format == "ndjson":
+            # keep messages out of the JSON
+            kwargs.setdefault("file", sys.stderr)
+        print(*args, **kwargs)
+
+
+def read_input(prompt=""):
+    """input(), but with ndjson output the prompt goes to standard error."""
+    if output_format == "ndjson":
+        tprint(prompt, end="", flush=True)
+        return input()
+    return input(prompt)
+
+
+def write_ndjson(items):
+    """Write Mastodon entities as JSON, one per line, in a single write."""
+    text = "".join(dump_status(item) + "\n" for item in items if item)
+    with output_lock:
+        sys.stdout.write(text)
+        sys.stdout.flush()
 
 
 def format_username(user):
@@ -778,23 +1911,35 @@ def format_user_counts(user):
 
 def format_display_name(name):
     if convert_emoji_to_shortcode:
-        name = emoji.demojize(name)
+        name = emoji_unicode_to_shortcodes(name)
         return name
     return name
 
 
 def printUser(user):
     """Prints user data nicely with hardcoded colors."""
+    if output_format == "ndjson":
+        write_ndjson([user])
+        return
     counts = stylize(format_user_counts(user), fg("blue"))
-
-    print(format_username(user) + " " + counts)
     display_name = format_display_name(user["display_name"])
-    cprint(display_name, fg("cyan"))
-    print(user["url"])
-    cprint(re.sub("<[^<]+?>", "", user["note"]), fg("red"))
+    # written at once, so a streamed toot can't end up in the middle
+    tprint(
+        "\n".join(
+            [
+                format_username(user) + " " + counts,
+                stylize(display_name, fg("cyan")),
+                user["url"],
+                stylize(re.sub("<[^<]+?>", "", user["note"]), fg("red")),
+            ]
+        )
+    )
 
 
 def printUsersShort(users):
+    if output_format == "ndjson":
+        write_ndjson(users)
+        return
     for user in users:
         if not user:
             continue
@@ -802,14 +1947,22 @@ def printUsersShort(users):
         display_name = format_display_name(user["display_name"])
         userdisp = "'" + str(display_name) + "'"
         userurl = str(user["url"])
-        cprint("  " + format_username(user), fg("green"), end=" ")
-        cprint(" " + userid, fg("red"), end=" ")
-        cprint(" " + userdisp, fg("cyan"))
-        cprint("      " + userurl, fg("blue"))
+        tprint(
+            stylize("  " + format_username(user), fg("green"))
+            + " "
+            + stylize(" " + userid, fg("red"))
+            + " "
+            + stylize(" " + userdisp, fg("cyan"))
+            + "\n"
+            + stylize("      " + userurl, fg("blue"))
+        )
 
 
 def format_time(time_event):
     """Return a formatted time and humanized time for a time event"""
+    import dateutil.parser
+    import humanize
+
     try:
         if not isinstance(time_event, datetime.datetime):
             time_event = dateutil.parser.parse(time_event)
@@ -875,42 +2028,78 @@ def format_toot_idline(toot):
     return " ".join(out)
 
 
-def printToot(toot, show_toot=False, dim=False):
-    if not toot:
-        return
+class RenderCache:
+    """An LRU cache of rendered toot text, so showing a toot again doesn't
+    parse and wrap its HTML again."""
+
+    def __init__(self, size=500):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+RENDERED_TOOTS = RenderCache()
+
+
+def format_toot_body(toot, show_toot=False):
+    """Get the content lines of a toot: content warning, filters, text and
+    media.
+
+    These don't change unless the toot is edited, so they are cached.  The
+    name and ID lines hold counters and times that do change and are
+    formatted separately every time."""
+    filtered = toot.get("filtered") or []
+    filter_titles = tuple(x["filter"]["title"] for x in filtered)
+    key = None
+    if toot.get("id") is not None:
+        key = (
+            toot["id"],
+            toot.get("edited_at"),
+            int(terminal_size.columns) - 2,
+            show_toot,
+            filter_titles,
+            # display settings
+            (convert_emoji_to_shortcode, show_media_links),
+        )
+        cached = RENDERED_TOOTS.get(key)
+        if cached is not None:
+            return cached
+
+    # toots are indexed for 'grep' even when hidden by a CW or filter
+    text = get_content(toot)
+    links = list(get_parser().get_links()) if toot.get("content") else []
+    # the links that aren't mentions or hashtags
+    weblinks = list(get_parser().weblinks) if toot.get("content") else []
 
     show_toot_text = True
     out = []
-    # if it's a boost, only output header line from toot
-    # then get other data from toot['reblog']
-    if toot.get("reblog"):
-        header = stylize("  Boosted by ", fg("yellow"))
-        display_name = format_display_name(toot["account"]["display_name"])
-        name = " ".join((display_name, format_username(toot["account"]) + ":"))
-        out.append(header + stylize(name, fg("blue")))
-        toot = toot["reblog"]
-
-    # get the first two lines
-    random.seed(toot["account"]["display_name"])
-    out += [
-        "  " + format_toot_nameline(toot, fg(random.choice(COLORS))),
-        "  " + format_toot_idline(toot),
-    ]
-
     if toot.get("spoiler_text", "") != "":
         # pass CW through get_content for wrapping/indenting
         faketoot = {"content": "[CW: " + toot["spoiler_text"] + "]"}
         out.append(stylize(get_content(faketoot), fg("red")))
         show_toot_text = False
 
-    if toot.get("filtered"):
-        filter_titles = ", ".join([x["filter"]["title"] for x in toot.filtered])
-        faketoot = {"content": "[Filter: " + filter_titles + "]"}
+    if filter_titles:
+        faketoot = {"content": "[Filter: " + ", ".join(filter_titles) + "]"}
         out.append(stylize(get_content(faketoot), fg("red")))
         show_toot_text = False
 
     if show_toot_text or show_toot:
-        out.append(get_content(toot))
+        out.append(text)
 
     if toot.get("status"):
         out.append(get_content(toot.get("status")))
@@ -921,14 +2110,51 @@ def printToot(toot, show_toot=False, dim=False):
         # simple version: output # of attachments. TODO: urls instead?
         out.append("\n".join(get_media_attachments(toot)))
 
+    body = tuple(out)
+    if key is not None:
+        RENDERED_TOOTS.put(key, body)
+        if toot.get("content") is not None and toot.get("account"):
+            SEARCH.add(toot, text, links, weblinks)
+    return body
+
+
+def format_toot(toot, show_toot=False, dim=False):
+    """Returns a toot rendered for the terminal."""
+    out = []
+    # if it's a boost, only output header line from toot
+    # then get other data from toot['reblog']
+    if toot.get("reblog"):
+        header = stylize("  Boosted by ", fg("yellow"))
+        display_name = format_display_name(toot["account"]["display_name"])
+        name = " ".join((display_name, format_username(toot["account"]) + ":"))
+        out.append(header + stylize(name, fg("blue")))
+        toot = toot["reblog"]
+
+    # get the first two lines; the color is picked per author.  Don't seed
+    # the shared generator, toots may be rendered on several threads.
+    color = random.Random(toot["account"]["display_name"]).choice(COLORS)
+    out += [
+        "  " + format_toot_nameline(toot, fg(color)),
+        "  " + format_toot_idline(toot),
+    ]
+
+    out.extend(format_toot_body(toot, show_toot))
+
     if toot.get("poll"):
         out.append(get_poll(toot))
 
     if dim:
-        cprint("\n".join(out), attr("dim"))
-    else:
-        print("\n".join(out))
-    print()
+        return stylize("\n".join(out), attr("dim"))
+    return "\n".join(out)
+
+
+def printToot(toot, show_toot=False, dim=False):
+    if not toot:
+        return
+    text = format_toot(toot, show_toot, dim)
+    with output_lock:
+        print(text)
+        print()
 
 
 def edittoot(text):
@@ -938,7 +2164,9 @@ def edittoot(text):
             "Using the editor while streaming is unsupported at this time.", fg("red")
         )
         return ""
-    edited_message = click.edit(text)
+    # streams in the background wait until the editor is closed
+    with output_lock:
+        edited_message = click.edit(text)
     if edited_message:
         return edited_message
     return ""
@@ -946,17 +2174,59 @@ def edittoot(text):
 
 def printList(list_item):
     """Prints list entry nicely with hardcoded colors."""
-    cprint(list_item["title"], fg("cyan"), end=" ")
-    cprint("(id: %s)" % list_item["id"], fg("red"))
+    with output_lock:
+        cprint(list_item["title"], fg("cyan"), end=" ")
+        cprint("(id: %s)" % list_item["id"], fg("red"))
 
 
 def printFilter(filter_item):
     """Prints filter entry nicely with hardcoded colors."""
-    cprint(filter_item["phrase"], fg("cyan"), end=" ")
-    cprint("(id: %s," % filter_item["id"], fg("red"), end=" ")
-    cprint("context: %s, " % filter_item["context"], fg("red"), end=" ")
-    cprint("expires_at: %s, " % filter_item["expires_at"], fg("red"), end=" ")
-    cprint("whole_word: %s)" % filter_item["whole_word"], fg("red"))
+    with output_lock:
+        cprint(filter_item["phrase"], fg("cyan"), end=" ")
+        cprint("(id: %s," % filter_item["id"], fg("red"), end=" ")
+        cprint("context: %s, " % filter_item["context"], fg("red"), end=" ")
+        cprint("expires_at: %s, " % filter_item["expires_at"], fg("red"), end=" ")
+        cprint("whole_word: %s)" % filter_item["whole_word"], fg("red"))
+
+
+def batch_status_action(mastodon, rest, action, verb, done, style):
+    """Run a status action (status_favourite, status_reblog, ...) for every
+    ID and ID range in rest, several at a time, then print the results in
+    the order the IDs were given.
+
+      action - Mastodon method taking a global ID and returning a status.
+      verb - Used in error messages: "Can't <verb> id 12".
+      done - Used to report success: "<done> (12):".
+      style - The colored style for successful results.
+    """
+    targets = []
+    failed = False
+    for local_id in rest_to_ids(rest):
+        global_id = IDS.lookup(local_id)
+        if global_id is None:
+            cprint(f"  Can't {verb} id {local_id}: Not found", fg("red") + attr("bold"))
+            failed = True
+            continue
+        targets.append((local_id, global_id))
+
+    results = run_batch(mastodon, lambda target: action(target[1]), targets)
+    multiple = len(results) > 1
+    for (local_id, _), status, error in results:
+        if error is not None:
+            failed = True
+            cprint(
+                f"  Can't {verb} id {local_id}: {type(error).__name__}: {error}",
+                fg("red") + attr("bold"),
+            )
+        else:
+            STATUS_CACHE.put(status)
+            # a reblog wraps the original toot, which has the content
+            status = status.get("reblog") or status
+            cprint(f"  {done} ({local_id}):\n" + get_content(status), style)
+        if multiple:
+            tprint()
+    if failed:
+        raise AlreadyPrintedException
 
 
 #####################################
@@ -965,14 +2235,19 @@ def printFilter(filter_item):
 commands = OrderedDict()
 
 
-def command(argstr=None, section=None):
-    """Adds the function to the command list."""
+def command(argstr=None, section=None, readonly=False):
+    """Adds the function to the command list.
+
+    Commands that only read (don't change anything on the server or in
+    tootstream other than the current page) are marked readonly; batch mode
+    runs those concurrently."""
 
     def inner(func):
         commands[func.__name__] = func
-        bisect.insort(completion_list, func.__name__)
+        completions.add(func.__name__, pinned=True)
         func.__argstr__ = argstr
         func.__section__ = section
+        func.__readonly__ = readonly
         return func
 
     return inner
@@ -991,7 +2266,7 @@ Tootstream Help:
 """
 
 
-@command("[<cmd>]", "Help")
+@command("[<cmd>]", "Help", readonly=True)
 def help(mastodon, rest):
     """List all commands or show detailed help.
 
@@ -1015,7 +2290,7 @@ def help(mastodon, rest):
             try:
                 cmd_func = commands[args[0]]
             except Exception:
-                print(__friendly_cmd_error__.format(rest))
+                tprint(__friendly_cmd_error__.format(rest))
                 return
 
             try:
@@ -1023,7 +2298,7 @@ def help(mastodon, rest):
             except Exception:
                 cmd_args = ""
             # print a friendly header and the detailed help
-            print(
+            tprint(
                 __friendly_help_header__.format(
                     cmd_func.__name__, cmd_args, cmd_func.__doc__
                 )
@@ -1035,7 +2310,7 @@ def help(mastodon, rest):
             section_filter = args[0].lower()
         else:
             # Command not found. Exit.
-            print(__friendly_cmd_error__.format(rest))
+            tprint(__friendly_cmd_error__.format(rest))
             return
 
     # Show full list (with section filtering if appropriate)
@@ -1062,7 +2337,7 @@ def help(mastodon, rest):
                 )
                 new_section = False
 
-            print("{:>14} {:<15}  {:<}".format(command, cmd_args, cmd_doc))
+            tprint("{:>14} {:<15}  {:<}".format(command, cmd_args, cmd_doc))
 
 
 @command("[<text>]", "Toots")
@@ -1093,19 +2368,30 @@ def toot(mastodon, rest):
         (text, kwargs) = flaghandler_tootreply(mastodon, rest)
     except KeyboardInterrupt:
         # user abort, return to main prompt
-        print("")
+        tprint("")
         return
 
-    kwargs["visibility"] = toot_visibility(
-        mastodon, flag_visibility=kwargs["visibility"]
-    )
+    try:
+        kwargs["visibility"] = toot_visibility(
+            mastodon, flag_visibility=kwargs["visibility"]
+        )
 
-    if text == "":
-        text = edittoot(text="")
+        if text == "":
+            text = edittoot(text="")
+
+        if not finish_media_uploads(kwargs):
+            return
+    except KeyboardInterrupt:
+        tprint("")
+        return
+    finally:
+        # does nothing once the uploads are finished
+        cancel_media_uploads(kwargs)
 
     while posted is False:
         try:
             resp = mastodon.status_post(text, **kwargs)
+            CREDENTIALS.adjust("statuses_count", 1)
             cprint("You tooted: ", fg("white") + attr("bold"), end="\n")
             if resp["sensitive"]:
                 cprint("CW: " + resp["spoiler_text"], fg("red"))
@@ -1120,11 +2406,10 @@ def toot(mastodon, rest):
             posted = True
 
         if posted is False:
-            retry = input("Edit toot and re-try? [Y/N]: ")
-            if retry.lower() == "y":
-                text = edittoot(text=text)
-            else:
-                posted = True
+            retry = read_input("Edit toot and re-try? [Y/N]: ")
+            if retry.lower() != "y":
+                raise AlreadyPrintedException
+            text = edittoot(text=text)
 
 
 @command("<id> [<text>]", "Toots")
@@ -1153,58 +2438,70 @@ def rep(mastodon, rest):
         (text, kwargs) = flaghandler_tootreply(mastodon, rest)
     except KeyboardInterrupt:
         # user abort, return to main prompt
-        print("")
-        return
-
-    (parent_id, _, text) = text.partition(" ")
-    parent_id = IDS.to_global(parent_id)
-    if parent_id is None:
-        msg = "  No message to reply to."
-        cprint(msg, fg("red"))
-        return
-
-    if not text:
-        text = edittoot(text="")
-
-    if parent_id is None or not text:
+        tprint("")
         return
 
     try:
-        parent_toot = mastodon.status(parent_id)
-    except Exception as e:
-        cprint("error searching for original: {}".format(type(e).__name__), fg("red"))
-        return
+        (parent_id, _, text) = text.partition(" ")
+        parent_id = IDS.to_global(parent_id)
+        if parent_id is None:
+            msg = "  No message to reply to."
+            cprint(msg, fg("red"))
+            raise AlreadyPrintedException
 
-    # Handle mentions text at the beginning:
-    mentions_set = set()
-    for i in parent_toot["mentions"]:
-        mentions_set.add(i["acct"])
-    mentions_set.add(parent_toot["account"]["acct"])
+        if not text:
+            text = edittoot(text="")
 
-    # Remove our account
-    # TODO: Better way to get this information?
-    my_user = mastodon.account_verify_credentials()
-    mentions_set.discard(my_user["username"])
-
-    # Format each using @username@host and add a space
-    mentions = ["@%s" % i for i in list(mentions_set)]
-    mentions = " ".join(mentions)
+        if parent_id is None or not text:
+            return
 
-    # if user didn't set cw/spoiler, set it here
-    if kwargs["spoiler_text"] is None and parent_toot["spoiler_text"] != "":
-        kwargs["spoiler_text"] = parent_toot["spoiler_text"]
+        try:
+            parent_toot = get_status(mastodon, parent_id)
+        except Exception as e:
+            cprint(
+                "error searching for original: {}".format(type(e).__name__), fg("red")
+            )
+            raise AlreadyPrintedException
 
-    kwargs["visibility"] = toot_visibility(
-        mastodon,
-        flag_visibility=kwargs["visibility"],
-        parent_visibility=parent_toot["visibility"],
-    )
+        # Handle mentions text at the beginning:
+        mentions_set = set()
+        for i in parent_toot["mentions"]:
+            mentions_set.add(i["acct"])
+        mentions_set.add(parent_toot["account"]["acct"])
+
+        # Remove our account
+        my_user = CREDENTIALS.get(mastodon)
+        mentions_set.discard(my_user["username"])
+
+        # Format each using @username@host and add a space
+        mentions = ["@%s" % i for i in list(mentions_set)]
+        mentions = " ".join(mentions)
+
+        # if user didn't set cw/spoiler, set it here
+        if kwargs["spoiler_text"] is None and parent_toot["spoiler_text"] != "":
+            kwargs["spoiler_text"] = parent_toot["spoiler_text"]
+
+        kwargs["visibility"] = toot_visibility(
+            mastodon,
+            flag_visibility=kwargs["visibility"],
+            parent_visibility=parent_toot["visibility"],
+        )
+
+        if not finish_media_uploads(kwargs):
+            return
+    except KeyboardInterrupt:
+        tprint("")
+        return
+    finally:
+        # does nothing once the uploads are finished
+        cancel_media_uploads(kwargs)
 
     while posted is False:
         try:
             reply_toot = mastodon.status_post(
                 "%s %s" % (mentions, text), in_reply_to_id=parent_id, **kwargs
             )
+            CREDENTIALS.adjust("statuses_count", 1)
             msg = "  Replied with:\n" + get_content(reply_toot)
             cprint(msg, attr("dim"))
             posted = True
@@ -1212,11 +2509,10 @@ def rep(mastodon, rest):
             cprint("error while posting: {}".format(type(e).__name__), fg("red"))
 
         if posted is False:
-            retry = input("Edit toot and re-try? [Y/N]: ")
-            if retry.lower() == "y":
-                text = edittoot(text=text)
-            else:
-                posted = True
+            retry = read_input("Edit toot and re-try? [Y/N]: ")
+            if retry.lower() != "y":
+                raise AlreadyPrintedException
+            text = edittoot(text=text)
 
 
 @command("<id> [votes]", "Toots")
@@ -1231,26 +2527,31 @@ def vote(mastodon, rest):
         poll_id = None
         toot_id, rest = rest.split(" ", 1)
         global_id = IDS.to_global(toot_id)
-        poll = mastodon.status(global_id).get("poll")
+        poll = get_status(mastodon, global_id).get("poll")
         if poll:
             poll_id = poll.get("id")
         if poll_id is None:
             cprint(f"  {toot_id} does not point to a valid poll.", fg("red"))
-            return
+            raise AlreadyPrintedException
 
         if rest is None:
             cprint("Note has no options.", fg("white") + bg("red"))
-            return
+            raise AlreadyPrintedException
 
         vote_options = rest_to_list(rest)
         if len(vote_options) > 1 and not poll.get("multiple"):
             cprint("Too many votes cast.", fg("white") + bg("red"))
-            return
+            raise AlreadyPrintedException
 
         mastodon.poll_vote(poll_id, vote_options)
-        print("Vote cast.")
+        # the cached poll results are stale now
+        STATUS_CACHE.discard(global_id)
+        tprint("Vote cast.")
+    except AlreadyPrintedException:
+        raise
     except Exception as e:
         cprint(f"  {e}", fg("red"))
+        raise AlreadyPrintedException
 
 
 @command("<id>", "Toots")
@@ -1258,95 +2559,75 @@ def delete(mastodon, rest):
     """Deletes your toot by ID"""
     rest = IDS.to_global(rest)
     if rest is None:
-        return
+        raise AlreadyPrintedException
     mastodon.status_delete(rest)
-    print("Poof! It's gone.")
+    STATUS_CACHE.discard(rest)
+    CREDENTIALS.adjust("statuses_count", -1)
+    tprint("Poof! It's gone.")
 
 
-@command("<id>", "Toots")
+@command("<id> [<id>]", "Toots")
 def boost(mastodon, rest):
-    """Boosts a toot by ID."""
-    rest = IDS.to_global(rest)
-    if rest is None:
-        return
-    try:
-        mastodon.status_reblog(rest)
-        boosted = mastodon.status(rest)
-        msg = "  You boosted:\n " + fg("white") + get_content(boosted)
-        cprint(msg, attr("dim"))
-    except Exception as e:
-        cprint("Received error: ", fg("red") + attr("bold"), end="")
-        cprint(e, fg("magenta") + attr("bold") + attr("underline"))
+    """Boosts a toot by ID or IDs.
+
+    ex: boost 23
+        boost 23 25 30-34"""
+    batch_status_action(
+        mastodon, rest, mastodon.status_reblog, "boost", "You boosted", attr("dim")
+    )
 
 
-@command("<id>", "Toots")
+@command("<id> [<id>]", "Toots")
 def unboost(mastodon, rest):
-    """Removes a boosted toot by ID."""
-    rest = IDS.to_global(rest)
-    if rest is None:
-        return
-    mastodon.status_unreblog(rest)
-    unboosted = mastodon.status(rest)
-    msg = "  Removed boost:\n " + get_content(unboosted)
-    cprint(msg, attr("dim"))
+    """Removes a boosted toot by ID or IDs."""
+    batch_status_action(
+        mastodon,
+        rest,
+        mastodon.status_unreblog,
+        "unboost",
+        "Removed boost",
+        attr("dim"),
+    )
 
 
 @command("<id> [<id>]", "Toots")
 def fav(mastodon, rest):
-    """Favorites a toot by ID or IDs."""
-    favorite_ids = rest_to_list(rest)
-    multiple = len(favorite_ids) > 1
-    for favorite_id in favorite_ids:
-        if favorite_id:
-            favorite_global_id = IDS.to_global(favorite_id)
-            if favorite_global_id is None:
-                cprint(
-                    f"  Can't favorite id {favorite_id}: Not found",
-                    fg("red") + attr("bold"),
-                )
-                next
-            faved = mastodon.status_favourite(favorite_global_id)
-            msg = f"  Favorited ({favorite_id}):\n" + get_content(faved)
-            cprint(msg, attr("dim"))
-            if multiple:
-                print()
+    """Favorites a toot by ID or IDs.
+
+    ex: fav 23
+        fav 23 25 30-34"""
+    batch_status_action(
+        mastodon, rest, mastodon.status_favourite, "favorite", "Favorited", attr("dim")
+    )
 
 
 @command("<id> [<id>]", "Toots")
 def unfav(mastodon, rest):
     """Removes a favorite toot by ID or IDs."""
-    favorite_ids = rest_to_list(rest)
-    multiple = len(favorite_ids) > 1
-    for favorite_id in favorite_ids:
-        if favorite_id:
-            favorite_global_id = IDS.to_global(favorite_id)
-            if favorite_global_id is None:
-                cprint(
-                    f"  Can't unfavorite id {favorite_id}: Not found",
-                    fg("red") + attr("bold"),
-                )
-                next
-            unfaved = mastodon.status_unfavourite(favorite_global_id)
-            msg = f"  Removed favorite ({favorite_id}):\n" + get_content(unfaved)
-            cprint(msg, fg("yellow"))
-            if multiple:
-                print()
+    batch_status_action(
+        mastodon,
+        rest,
+        mastodon.status_unfavourite,
+        "unfavorite",
+        "Removed favorite",
+        fg("yellow"),
+    )
 
 
-@command("<id>", "Toots")
+@command("<id>", "Toots", readonly=True)
 def show(mastodon, rest):
     """Shows a toot by ID"""
     rest = IDS.to_global(rest)
     if rest is None:
-        return
-    printToot(mastodon.status(rest), show_toot=True)
+        raise AlreadyPrintedException
+    printToot(get_status(mastodon, rest), show_toot=True)
 
 
-@command("", "Filter")
+@command("", "Filter", readonly=True)
 def filters(mastodon, rest):
     """Shows the filters that the user has created."""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     user_filters = mastodon.filters()
     if len(user_filters) == 0:
         cprint("No filters found", fg("red"))
@@ -1355,65 +2636,97 @@ def filters(mastodon, rest):
         printFilter(filter_item)
 
 
-@command("<id>", "Toots")
+@command("<id> [<id>]", "Toots")
 def bookmark(mastodon, rest):
-    """Bookmark a toot by ID."""
-    rest = IDS.to_global(rest)
-    if rest is None:
-        return
-    mastodon.status_bookmark(rest)
-    item = mastodon.status(rest)
-    msg = "  Bookmarked:\n" + get_content(item)
-    cprint(msg, fg("red"))
+    """Bookmark a toot by ID or IDs."""
+    batch_status_action(
+        mastodon, rest, mastodon.status_bookmark, "bookmark", "Bookmarked", fg("red")
+    )
 
 
-@command("<id>", "Toots")
+@command("<id> [<id>]", "Toots")
 def unbookmark(mastodon, rest):
-    """Remove a bookmark from a toot by ID."""
-    rest = IDS.to_global(rest)
-    if rest is None:
-        return
-    mastodon.status_unbookmark(rest)
-    item = mastodon.status(rest)
-    msg = "  Removed bookmark: " + get_content(item)
-    cprint(msg, fg("yellow"))
+    """Remove a bookmark from a toot by ID or IDs."""
+    batch_status_action(
+        mastodon,
+        rest,
+        mastodon.status_unbookmark,
+        "unbookmark",
+        "Removed bookmark",
+        fg("yellow"),
+    )
 
 
-@command("<id>", "Toots")
+@command("<id> [<workers>]", "Toots")
 def favthread(mastodon, rest):
     """Favorites an entire thread
 
-    ex: favthread 23 """
+    Toots that are already favorited are skipped.  Up to <workers> toots
+    (default 4) are favorited at the same time.
+
+    ex: favthread 23
+        favthread 23 8"""
+
+    (rest, _, workers) = rest.strip().partition(" ")
+    try:
+        workers = int(workers) if workers.strip() else BATCH_WORKERS
+    except ValueError:
+        cprint(f"  invalid number of workers: {workers}", fg("red"))
+        raise AlreadyPrintedException
+    workers = max(min(workers, MAX_BATCH_WORKERS), 1)
 
     rest = IDS.to_global(rest)
     if rest is None:
+        raise AlreadyPrintedException
+
+    conversation = mastodon.status_context(rest)
+    toots = (
+        conversation.get("ancestors")
+        + [get_status(mastodon, rest)]
+        + conversation.get("descendants")
+    )
+    todo = [toot for toot in toots if not toot.get("favourited")]
+    if not todo:
+        cprint("  Every toot in this thread is already favorited.", fg("yellow"))
         return
 
-    ids = []
+    results = run_batch(
+        mastodon,
+        lambda toot: mastodon.status_favourite(toot["id"]),
+        todo,
+        workers,
+        progress=print_progress("Favoriting thread"),
+    )
 
-    conversation = mastodon.status_context(rest)
-    ancestors = conversation.get('ancestors')
-    descendants = conversation.get('descendants')
-
-    ancestor_ids = [i.id for i in ancestors]
-    descendant_ids = [i.id for i in descendants]
-
-    ids = ancestor_ids + [rest] + descendant_ids
-    for favorite_global_id in ids:
-        faved = mastodon.status_favourite(favorite_global_id)
-        favorite_id = IDS.to_local(favorite_global_id)
-        msg = f"  Favorited ({favorite_id}):\n" + get_content(faved)
-        cprint(msg, attr("dim"))
-        print()
+    failed = 0
+    for toot, faved, error in results:
+        if error is not None:
+            failed += 1
+            cprint(
+                "  Can't favorite id {}: {}: {}".format(
+                    IDS.to_local(toot["id"]), type(error).__name__, error
+                ),
+                fg("red") + attr("bold"),
+            )
+        else:
+            STATUS_CACHE.put(faved)
+    cprint(
+        "  Favorited {} toots ({} already favorited, {} failed).".format(
+            len(todo) - failed, len(toots) - len(todo), failed
+        ),
+        attr("dim"),
+    )
+    if failed:
+        raise AlreadyPrintedException
 
 
-@command("<id>", "Toots")
+@command("<id>", "Toots", readonly=True)
 def showhistory(mastodon, rest):
     """Shows the history of the conversation for an ID with CWs/ Filters displayed"""
     history(mastodon, rest, show_toot=True)
 
 
-@command("<id>", "Toots")
+@command("<id>", "Toots", readonly=True)
 def history(mastodon, rest, show_toot=False):
     """Shows the history of the conversation for an ID.
 
@@ -1421,10 +2734,10 @@ def history(mastodon, rest, show_toot=False):
     stepper, rest = step_flag(rest)
     rest = IDS.to_global(rest)
     if rest is None:
-        return
+        raise AlreadyPrintedException
 
     try:
-        current_toot = mastodon.status(rest)
+        current_toot = get_status(mastodon, rest)
         conversation = mastodon.status_context(rest)
         print_toots(
             mastodon,
@@ -1448,9 +2761,10 @@ def history(mastodon, rest, show_toot=False):
         # completion_add(current_toot)
     except Exception as e:
         cprint("{}: please try again later".format(type(e).__name__), fg("red"))
+        raise AlreadyPrintedException
 
 
-@command("<id>", "Toots")
+@command("<id>", "Toots", readonly=True)
 def showthread(mastodon, rest):
     """Shows the complete thread of the conversation for an ID while showing CWs / filters.
 
@@ -1458,7 +2772,7 @@ def showthread(mastodon, rest):
     thread(mastodon, rest, show_toot=True)
 
 
-@command("<id>", "Toots")
+@command("<id>", "Toots", readonly=True)
 def thread(mastodon, rest, show_toot=False):
     """Shows the complete thread of the conversation for an ID.
 
@@ -1470,12 +2784,12 @@ def thread(mastodon, rest, show_toot=False):
 
     rest = IDS.to_global(rest)
     if rest is None:
-        return
+        raise AlreadyPrintedException
 
-    try:
-        # First display the history
-        history(mastodon, original_rest, show_toot)
+    # First display the history
+    history(mastodon, original_rest, show_toot)
 
+    try:
         # Then display the rest
         # current_toot = mastodon.status(rest)
         conversation = mastodon.status_context(rest)
@@ -1488,11 +2802,11 @@ def thread(mastodon, rest, show_toot=False):
         )
 
     except Exception as e:
-        raise e
         cprint("{}: please try again later".format(type(e).__name__), fg("red"))
+        raise AlreadyPrintedException
 
 
-@command("<id>", "Toots")
+@command("<id>", "Toots", readonly=True)
 def puburl(mastodon, rest):
     """Shows the public URL of a toot, optionally open in browser.
 
@@ -1509,25 +2823,26 @@ def puburl(mastodon, rest):
 
     status_id = IDS.to_global(args[0])
     if status_id is None:
-        return
+        raise AlreadyPrintedException
 
     try:
-        toot = mastodon.status(status_id)
+        toot = get_status(mastodon, status_id)
     except Exception as e:
         cprint("{}: please try again later".format(type(e).__name__), fg("red"))
-    else:
-        url = toot.get("url")
+        raise AlreadyPrintedException
+    url = toot.get("url")
 
     if len(args) == 1:
         # Print public url
-        print("{}".format(url))
+        tprint("{}".format(url))
     elif len(args) == 2 and args[1] == "open":
-        webbrowser.open(url)
+        open_url(url)
     else:
         cprint("PubURL argument was not correct. Please try again.", fg("red"))
+        raise AlreadyPrintedException
 
 
-@command("<id>", "Toots")
+@command("<id>", "Toots", readonly=True)
 def links(mastodon, rest):
     """Show URLs or any links in a toot, optionally open in browser.
 
@@ -1548,13 +2863,15 @@ def links(mastodon, rest):
 
     status_id = IDS.to_global(args[0])
     if status_id is None:
-        return
+        raise AlreadyPrintedException
 
     try:
-        toot = mastodon.status(status_id)
+        toot = get_status(mastodon, status_id)
+        toot_parser = get_parser()
         toot_parser.parse(toot["content"])
     except Exception as e:
         cprint("{}: please try again later".format(type(e).__name__), fg("red"))
+        raise AlreadyPrintedException
     else:
         links = toot_parser.get_weblinks()
         for media in toot.get("media_attachments"):
@@ -1563,7 +2880,7 @@ def links(mastodon, rest):
         if len(args) == 1:
             # Print links
             for i, link in enumerate(links):
-                print("{}: {}".format(i + 1, link))
+                tprint("{}: {}".format(i + 1, link))
         else:
             # Open links
             link_num = None
@@ -1577,108 +2894,184 @@ def links(mastodon, rest):
                         ),
                         fg("red"),
                     )
-                else:
-                    webbrowser.open(links[link_num - 1])
+                    raise AlreadyPrintedException
+                open_url(links[link_num - 1])
 
             elif args[1] == "open":
                 for link in links:
-                    webbrowser.open(link)
+                    open_url(link)
             else:
                 cprint("Links argument was not correct. Please try again.", fg("red"))
+                raise AlreadyPrintedException
 
 
-@command("", "Timeline")
+@command("", "Timeline", readonly=True)
 def home(mastodon, rest):
     """Displays the Home timeline."""
-    global LAST_PAGE, LAST_CONTEXT
     stepper, rest = step_flag(rest)
     limit, rest = limit_flag(rest)
-    LAST_PAGE = mastodon.timeline_home(limit=limit)
-    LAST_CONTEXT = "home"
-    print_toots(mastodon, LAST_PAGE, stepper, limit, ctx_name=LAST_CONTEXT)
+    page = load_page(mastodon, "home", timeline_loader(mastodon, "home", limit))
+    print_toots(mastodon, page, stepper, limit, ctx_name="home")
 
 
-@command("", "Timeline")
+@command("", "Timeline", readonly=True)
 def fed(mastodon, rest):
     """Displays the Federated timeline."""
-    global LAST_PAGE, LAST_CONTEXT
     stepper, rest = step_flag(rest)
     limit, rest = limit_flag(rest)
-    LAST_PAGE = mastodon.timeline_public(limit=limit)
-    LAST_CONTEXT = "federated timeline"
-    print_toots(mastodon, LAST_PAGE, stepper, limit, ctx_name=LAST_CONTEXT)
+    context = "federated timeline"
+    page = load_page(mastodon, context, lambda: mastodon.timeline_public(limit=limit))
+    print_toots(mastodon, page, stepper, limit, ctx_name=context)
 
 
-@command("", "Timeline")
+@command("", "Timeline", readonly=True)
 def local(mastodon, rest):
     """Displays the Local timeline."""
-    global LAST_PAGE, LAST_CONTEXT
     stepper, rest = step_flag(rest)
     limit, rest = limit_flag(rest)
-    LAST_PAGE = mastodon.timeline_local(limit=limit)
-    LAST_CONTEXT = "local timeline"
-    print_toots(mastodon, LAST_PAGE, stepper, limit, ctx_name=LAST_CONTEXT)
+    context = "local timeline"
+    page = load_page(mastodon, context, timeline_loader(mastodon, "local", limit))
+    print_toots(mastodon, page, stepper, limit, ctx_name=context)
 
 
 @command("", "Timeline")
 def next(mastodon, rest):
     """Displays the next page of paginated results."""
-    global LAST_PAGE, LAST_CONTEXT
-    curr_page = LAST_PAGE
     stepper, rest = step_flag(rest)
     if LAST_PAGE:
-        LAST_PAGE = mastodon.fetch_next(LAST_PAGE)
-        if LAST_PAGE:
+        page = PAGES.forward()
+        if page is None:
+            last = LAST_PAGE
+            page = PREFETCHER.take(mastodon, last)
+            if page:
+                PAGES.push_next(page, lambda: next_page(mastodon, last))
+        if page:
+            set_page(mastodon, page, LAST_CONTEXT)
             print_toots(mastodon, LAST_PAGE, stepper, ctx_name=LAST_CONTEXT)
             return
-        else:
-            LAST_PAGE = curr_page
     if LAST_CONTEXT:
         cprint(
             "No more toots in current context: " + LAST_CONTEXT, fg("white") + bg("red")
         )
     else:
         cprint("No current context.", fg("white") + bg("red"))
+        raise AlreadyPrintedException
 
 
 @command("", "Timeline")
 def prev(mastodon, rest):
     """Displays the previous page of paginated results."""
-    global LAST_PAGE, LAST_CONTEXT
     stepper, rest = step_flag(rest)
-    curr_page = LAST_PAGE
     if LAST_PAGE:
-        LAST_PAGE = mastodon.fetch_previous(LAST_PAGE)
-        if LAST_PAGE:
+        page = PAGES.back()
+        if page is None:
+            last = LAST_PAGE
+            page = previous_page(mastodon, last)
+            if page:
+                PAGES.push_prev(page, lambda: previous_page(mastodon, last))
+        if page:
+            set_page(mastodon, page, LAST_CONTEXT)
             print_toots(mastodon, LAST_PAGE, stepper, ctx_name=LAST_CONTEXT)
             return
-        else:
-            LAST_PAGE = curr_page
     if LAST_CONTEXT:
         cprint(
             "No more toots in current context: " + LAST_CONTEXT, fg("white") + bg("red")
         )
     else:
         cprint("No current context.", fg("white") + bg("red"))
+        raise AlreadyPrintedException
+
 
+@command("", "Timeline")
+def refresh(mastodon, rest):
+    """Fetches the current page of paginated results again.
 
-@command("<timeline>", "Timeline")
+    'next' and 'prev' show pages you have already seen from memory; use
+    this to get an up to date copy."""
+    stepper, rest = step_flag(rest)
+    if not LAST_PAGE:
+        cprint("No current context.", fg("white") + bg("red"))
+        raise AlreadyPrintedException
+    page = PAGES.reload()
+    if page:
+        set_page(mastodon, page, LAST_CONTEXT)
+        print_toots(mastodon, LAST_PAGE, stepper, ctx_name=LAST_CONTEXT)
+    else:
+        cprint(
+            "No more toots in current context: " + LAST_CONTEXT, fg("white") + bg("red")
+        )
+
+
+@command("[add|remove|ls] <timeline>", "Timeline")
 def stream(mastodon, rest):
-    """Streams a timeline. Specify home, fed, local, list, or a #hashtagname.
+    """Streams timelines. Specify home, fed, local, list, or a #hashtagname.
 
     Timeline 'list' requires a list name (ex: stream list listname).
 
-    Commands may be typed while streaming (ex: fav 23).
+    'stream <timeline>' shows the stream until you press ctrl+c.  Commands
+    may be typed while streaming (ex: fav 23).
 
-    Only one stream may be running at a time.
+    'stream add <timeline>' streams in the background and returns to the
+    prompt; add as many as you like.  Each toot is labelled with its
+    stream.  'stream ls' lists the streams and 'stream remove <label>'
+    (or 'stream remove all') stops them.
 
-    Use ctrl+c to end streaming"""
+    All streams share a single connection to the server.
 
+    ex: stream add home
+        stream add #python
+        stream remove #python"""
     global is_streaming
-    if is_streaming:
-        cprint("Already streaming. Press ctrl+c to end this stream.", fg("red"))
+    action, _, timeline = rest.partition(" ")
+    timeline = timeline.strip()
+
+    if action == "ls":
+        subscriptions = STREAMS.subscriptions
+        if not subscriptions:
+            cprint("Not streaming.", fg("magenta"))
+            return
+        for subscription in subscriptions:
+            cprint("  {}".format(subscription.label), fg("cyan"), end=" ")
+            cprint("({} toots)".format(subscription.received), fg("magenta"))
+        state = "connected" if STREAMS.stream.connected else "connecting"
+        queue = STREAMS.queue
+        cprint(
+            "  {}, {} received, {} dropped, {} of {} queued".format(
+                state, queue.received, queue.dropped, queue.depth, queue.maxsize
+            ),
+            fg("magenta"),
+        )
+        return
+
+    if action in ("remove", "rm"):
+        labels = [timeline]
+        if timeline == "all":
+            labels = [subscription.label for subscription in STREAMS.subscriptions]
+        missing = False
+        for label in labels:
+            if STREAMS.remove(label) is None:
+                cprint("Not streaming {}.".format(label), fg("red"))
+                missing = True
+            else:
+                cprint("Stopped streaming {}.".format(label), fg("magenta"))
+        if missing:
+            raise AlreadyPrintedException
+        return
+
+    if action == "add":
+        try:
+            subscription = stream_subscription(mastodon, timeline)
+            STREAMS.add(mastodon, subscription)
+        except Exception as e:
+            cprint("Something went wrong: {}".format(e), fg("red"))
+            raise AlreadyPrintedException
+        cprint("Streaming {}.".format(subscription.label), fg("magenta"))
         return
 
+    if STREAMS.foreground is not None:
+        cprint("Already streaming. Press ctrl+c to end this stream.", fg("red"))
+        raise AlreadyPrintedException
+
     cprint("Initializing stream...", style=fg("magenta"))
 
     def say_error(*args, **kwargs):
@@ -1688,60 +3081,24 @@ def stream(mastodon, rest):
         )
 
     try:
-        if rest == "home" or rest == "":
-            handle = mastodon.stream_user(
-                toot_listener, run_async=True, reconnect_async=True
-            )
-        elif rest == "fed" or rest == "public":
-            handle = mastodon.stream_public(
-                toot_listener, run_async=True, reconnect_async=True
-            )
-        elif rest == "local":
-            handle = mastodon.stream_local(
-                toot_listener, run_async=True, reconnect_async=True
-            )
-        elif rest.startswith("list"):
-            # Remove list from the rest string
-            items = rest.split("list ")
-            if len(items) < 2:
-                print("list stream must have a list ID.")
-                return
-            item = get_list_id(mastodon, items[-1])
-            handle = mastodon.stream_list(
-                item, toot_listener, run_async=True, reconnect_async=True
-            )
-        elif rest.startswith("#"):
-            tag = rest[1:]
-            handle = mastodon.stream_hashtag(
-                tag, toot_listener, run_async=True, reconnect_async=True
-            )
-        else:
-            handle = None
-            print(
-                "Only 'home', 'fed', 'local', 'list', and '#hashtag' streams are supported."
-            )
+        subscription = stream_subscription(mastodon, rest)
+        STREAMS.add(mastodon, subscription)
     except KeyboardInterrupt:
         # Prevent the ^C from interfering with the prompt
-        print("\n")
-    except KeyError as e:
-        if getattr(e, "args", None) == ("urls",):
-            cprint(
-                "The Mastodon instance is too old for this version of streaming support.",
-                fg("red"),
-            )
-        else:
-            cprint("Something went wrong: {}".format(e), fg("red"))
+        tprint("\n")
+        return
     except Exception as e:
         cprint("Something went wrong: {}".format(e), fg("red"))
-    else:
-        print("Use 'help' for a list of commands or press ctrl+c to end streaming.")
+        raise AlreadyPrintedException
+    tprint("Use 'help' for a list of commands or press ctrl+c to end streaming.")
 
-    if handle is not None:
-        is_streaming = True
-        command = None
+    is_streaming = True
+    STREAMS.foreground = subscription.label
+    command = None
+    try:
         while command != "abort":
             try:
-                command = input().split(" ", 1)
+                command = read_input().split(" ", 1)
             except KeyboardInterrupt:
                 cprint(
                     "Wrapping up, this can take a couple of seconds...",
@@ -1755,15 +3112,64 @@ def stream(mastodon, rest):
                     rest_ = ""
                 command = command[0]
                 cmd_func = commands.get(command, say_error)
-                cmd_func(mastodon, rest_)
-        try:
-            handle.close()
-        except AttributeError:
-            handle.running = False
-            pass  # Trap for handle not getting set if no toots were received while streaming
+                try:
+                    cmd_func(mastodon, rest_)
+                except AlreadyPrintedException:
+                    pass
+    finally:
+        STREAMS.foreground = None
+        STREAMS.remove(subscription.label)
         is_streaming = False
 
 
+@command("[<timeline>|every <minutes>|off]", "Timeline")
+def sync(mastodon, rest):
+    """Fetches new toots into the local timeline store.
+
+    home, local and listhome show toots from the store and only fetch what
+    is new, so catching up takes a few requests.  Toots missing between
+    stored ones are fetched as well.
+
+    ex: sync                (home and every timeline viewed so far)
+        sync local
+        sync list listname
+        sync every 10       (sync in the background every 10 minutes)
+        sync off            (stop syncing in the background)"""
+    if not STORE.is_open:
+        cprint("The timeline store is disabled (--no-cache).", fg("red"))
+        raise AlreadyPrintedException
+    action, _, arg = rest.strip().partition(" ")
+
+    if action == "every":
+        try:
+            minutes = float(arg)
+        except ValueError:
+            cprint("  usage: sync every <minutes>", fg("red"))
+            raise AlreadyPrintedException
+        if minutes <= 0:
+            cprint("  usage: sync every <minutes>", fg("red"))
+            raise AlreadyPrintedException
+        AUTO_SYNC.start(mastodon, minutes * 60)
+        cprint("Syncing every {:g} minutes.".format(minutes), fg("green"))
+        return
+    if action == "off":
+        AUTO_SYNC.stop()
+        cprint("Stopped syncing in the background.", fg("green"))
+        return
+
+    if action == "":
+        timelines = None
+    elif action in ("home", "local"):
+        timelines = [action]
+    elif action == "list":
+        timelines = ["list:{}".format(get_list_id(mastodon, arg))]
+    else:
+        cprint("  usage: sync [home|local|list <list>|every <minutes>|off]", fg("red"))
+        raise AlreadyPrintedException
+    for timeline, added in sync_timelines(mastodon, timelines):
+        cprint("  {}: {} new toots".format(timeline, added), fg("green"))
+
+
 @command("", "Timeline")
 def mentions(mastodon, rest):
     """Displays the Notifications timeline with only mentions
@@ -1792,6 +3198,7 @@ def note(mastodon, rest):
         -r    Filter follow requests
         -u    Filter updates"""
 
+    global LAST_NOTES
     displayed_notification = False
 
     # Fill in Content fields first.
@@ -1799,7 +3206,7 @@ def note(mastodon, rest):
         (text, kwargs) = flaghandler_note(mastodon, rest)
     except KeyboardInterrupt:
         # user abort, return to main prompt
-        print("")
+        tprint("")
         return
 
     notifications = (
@@ -1808,6 +3215,14 @@ def note(mastodon, rest):
     if not (len(notifications) > 0):
         cprint("You don't have any notifications yet.", fg("magenta"))
         return
+    STATUS_CACHE.put_many([note.get("status") for note in notifications])
+    LAST_NOTES = []
+
+    if output_format == "ndjson":
+        shown = [note for note in reversed(notifications) if kwargs.get(note["type"])]
+        LAST_NOTES = [(str(note["id"]), note["type"]) for note in shown]
+        write_ndjson(shown)
+        return
 
     for note in reversed(notifications):
         note_type = note.get("type")
@@ -1826,31 +3241,45 @@ def note(mastodon, rest):
 
         # Check if we should even display this note type
         if kwargs[note_type]:
+            LAST_NOTES.append((note_id, note_type))
+            # Each notification is written at once, so a streamed toot
+            # can't end up in the middle of it
+            out = []
             # Display Note ID
-            cprint(" note: " + note_id, fg("magenta"))
+            out.append(stylize(" note: " + note_id, fg("magenta")))
 
             # Mentions
             if note_type == "mention":
                 displayed_notification = True
-                cprint(display_name + username, fg("magenta"))
-                print("  " + format_toot_idline(note_status) + "  " + note_time)
-                cprint(get_content(note_status), attr("bold"), fg("white"))
-                print(stylize("", attr("dim")))
+                out.append(stylize(display_name + username, fg("magenta")))
+                out.append("  " + format_toot_idline(note_status) + "  " + note_time)
+                out.append(
+                    stylize(get_content(note_status), attr("bold") + fg("white"))
+                )
+                out.append(stylize("", attr("dim")))
                 if note_media_attachments:
-                    print("\n".join(get_media_attachments(note_status)))
+                    out.append("\n".join(get_media_attachments(note_status)))
 
             # Follows
             elif note_type == "follow":
                 displayed_notification = True
-                print("  ", end="")
-                cprint(display_name + username + " followed you!", fg("yellow"))
+                out.append(
+                    "  "
+                    + stylize(display_name + username + " followed you!", fg("yellow"))
+                )
 
             elif note_type == "follow_request":
                 displayed_notification = True
-                cprint(display_name + username + " sent a follow request", fg("yellow"))
-                cprint(
-                    "  Use 'accept' or 'reject' to accept or reject the request",
-                    fg("yellow"),
+                out.append(
+                    stylize(
+                        display_name + username + " sent a follow request", fg("yellow")
+                    )
+                )
+                out.append(
+                    stylize(
+                        "  Use 'accept' or 'reject' to accept or reject the request",
+                        fg("yellow"),
+                    )
                 )
 
             # Update
@@ -1858,27 +3287,53 @@ def note(mastodon, rest):
                 displayed_notification = True
                 countsline = format_toot_idline(note_status)
                 content = get_content(note_status)
-                cprint(display_name + username, fg(random.choice(COLORS)), end="")
                 if note_type == "update":
-                    cprint(f" updated their status:", fg("yellow"))
+                    action = " updated their status:"
                 elif note_type == "reblog":
-                    cprint(f" boosted your status:", fg("yellow"))
+                    action = " boosted your status:"
                 elif note_type == "poll":
-                    cprint(f" ended their poll:", fg("yellow"))
+                    action = " ended their poll:"
                 else:
-                    cprint(f" favorited your status:", fg("yellow"))
-                print("  " + countsline + stylize(note_time, attr("dim")))
-                cprint(content, attr("dim"))
+                    action = " favorited your status:"
+                out.append(
+                    stylize(display_name + username, fg(random.choice(COLORS)))
+                    + stylize(action, fg("yellow"))
+                )
+                out.append("  " + countsline + stylize(note_time, attr("dim")))
+                out.append(stylize(content, attr("dim")))
                 if getattr(note_status, "poll", None):
                     poll = get_poll(note_status)
-                    cprint(poll, attr("dim"))
+                    out.append(stylize(poll, attr("dim")))
 
-            print()
+            out.append("")
+            tprint("\n".join(out))
 
     if not displayed_notification:
         cprint("No notifications of this type are available.", fg("magenta"))
 
 
+def select_notes(rest):
+    """Expand dismiss arguments into a list of note IDs.
+
+    Accepts note IDs, ranges of note IDs and 'type:<type>'.  Ranges and
+    types select from the notifications shown by the last 'note'."""
+    note_ids = []
+    for item in rest_to_list(rest):
+        start, sep, end = item.partition("-")
+        if item.startswith("type:"):
+            note_type = item[len("type:") :]
+            note_ids.extend(i for i, t in LAST_NOTES if t == note_type)
+        elif sep and start.isdigit() and end.isdigit():
+            low, high = sorted((int(start), int(end)))
+            note_ids.extend(
+                i for i, t in LAST_NOTES if i.isdigit() and low <= int(i) <= high
+            )
+        elif item:
+            note_ids.append(item)
+    # keep the first occurrence of each ID
+    return list(OrderedDict.fromkeys(note_ids))
+
+
 @command("[<note_id>]", "Timeline")
 def dismiss(mastodon, rest):
     """Dismisses notifications.
@@ -1887,22 +3342,39 @@ def dismiss(mastodon, rest):
 
     dismiss clears all notifications if no note ID is provided.
     dismiss 1234567 will dismiss note ID 1234567. Dismiss accepts a list of IDs.
+    dismiss 1234567-1234590 dismisses the notes in that range and
+    dismiss type:favourite the favourite notes shown by the last `note`.
+    Types are mention, favourite, reblog, follow, follow_request, poll and update.
 
     The note ID is the id provided by the `note` command.
     """
+    if rest != "":
+        dismiss_ids = select_notes(rest)
+        if not dismiss_ids:
+            cprint(" No notes matched. Use `note` to list notifications.", fg("red"))
+            raise AlreadyPrintedException
     try:
         if rest == "":
             mastodon.notifications_clear()
             cprint(" All notifications were dismissed. ", fg("yellow"))
-        else:
-            if rest is None:
-                return
-            dismiss_ids = rest_to_list(rest)
-            for dismiss_id in dismiss_ids:
-                mastodon.notifications_dismiss(dismiss_id)
-                cprint(" Note " + dismiss_id + " was dismissed. ", fg("yellow"))
+            return
+        results = run_batch(mastodon, mastodon.notifications_dismiss, dismiss_ids)
     except Exception as e:
         cprint("Something went wrong: {}".format(e), fg("red"))
+        raise AlreadyPrintedException
+
+    failed = [(i, e) for i, _, e in results if e is not None]
+    cprint(
+        " Dismissed {} of {} notes. ".format(len(results) - len(failed), len(results)),
+        fg("yellow"),
+    )
+    for dismiss_id, error in failed:
+        cprint(
+            " Note {} was not dismissed: {}".format(dismiss_id, type(error).__name__),
+            fg("red"),
+        )
+    if failed:
+        raise AlreadyPrintedException
 
 
 @command("<user>", "Users")
@@ -1914,11 +3386,11 @@ def block(mastodon, rest):
         block @user@instance.example.com"""
     userid = get_unique_userid(mastodon, rest)
     relations = mastodon.account_block(userid)
+    CREDENTIALS.invalidate()
     if relations["blocking"]:
         cprint("  user " + str(userid) + " is now blocked", fg("blue"))
         username = "@" + mastodon.account(userid)["acct"]
-        if username in completion_list:
-            completion_list.remove(username)
+        completions.remove(username)
 
 
 @command("<user>", "Users")
@@ -1932,8 +3404,7 @@ def unblock(mastodon, rest):
     if not relations["blocking"]:
         cprint("  user " + str(userid) + " is now unblocked", fg("blue"))
         username = "@" + mastodon.account(userid)["acct"]
-        if username not in completion_list:
-            bisect.insort(completion_list, username)
+        completions.add(username)
 
 
 @command("<user>", "Users")
@@ -1944,11 +3415,11 @@ def follow(mastodon, rest):
         follow @user@instance.example.com"""
     userid = get_unique_userid(mastodon, rest)
     relations = mastodon.account_follow(userid)
+    CREDENTIALS.invalidate()
     if relations["following"]:
         cprint("  user " + str(userid) + " is now followed", fg("blue"))
         username = "@" + mastodon.account(userid)["acct"]
-        if username not in completion_list:
-            bisect.insort(completion_list, username)
+        completions.add(username)
 
 
 @command("<user>", "Users")
@@ -1959,11 +3430,11 @@ def unfollow(mastodon, rest):
         unfollow @user@instance.example.com"""
     userid = get_unique_userid(mastodon, rest)
     relations = mastodon.account_unfollow(userid)
+    CREDENTIALS.invalidate()
     if not relations.get("following"):
         cprint("  user " + str(userid) + " is now unfollowed", fg("blue"))
     username = "@" + mastodon.account(userid)["acct"]
-    if username in completion_list:
-        completion_list.remove(username)
+    completions.remove(username)
 
 
 @command("<user> [<duration>]", "Users")
@@ -1980,6 +3451,8 @@ def mute(mastodon, rest):
     else:
         username = rest
     if mute_time:
+        import pytimeparse
+
         mute_seconds = pytimeparse.parse(mute_time)
     userid = get_unique_userid(mastodon, username)
     relations = mastodon.account_mute(userid, duration=mute_seconds)
@@ -2003,14 +3476,13 @@ def unmute(mastodon, rest):
         cprint("  user " + username + " is now unmuted", fg("blue"))
 
 
-@command("<query>", "Discover")
+@command("<query>", "Discover", readonly=True)
 def search(mastodon, rest):
     """Search for a #tag or @user.
 
     ex:  search #tagname
          search @user
          search @user@instance.example.com"""
-    global LAST_PAGE, LAST_CONTEXT
     usage = str("  usage: search #tagname\n" + "         search @username")
     stepper, rest = step_flag(rest)
     limit, rest = rest_limit(rest)
@@ -2019,7 +3491,7 @@ def search(mastodon, rest):
         query = rest[1:]
     except Exception:
         cprint(usage, fg("red"))
-        return
+        raise AlreadyPrintedException
 
     # @ user search
     if indicator == "@" and not query == "":
@@ -2031,11 +3503,11 @@ def search(mastodon, rest):
 
     # # hashtag search
     elif indicator == "#" and not query == "":
-        LAST_PAGE = mastodon.timeline_hashtag(query, limit=limit)
-        LAST_CONTEXT = "search for #{}".format(query)
-        print_toots(
-            mastodon, LAST_PAGE, stepper, ctx_name=LAST_CONTEXT, add_completion=False
+        context = "search for #{}".format(query)
+        page = load_page(
+            mastodon, context, lambda: mastodon.timeline_hashtag(query, limit=limit)
         )
+        print_toots(mastodon, page, stepper, ctx_name=context, add_completion=False)
     # end #
 
     else:
@@ -2043,7 +3515,42 @@ def search(mastodon, rest):
     return
 
 
-@command("<user> [<N>]", "Discover")
+@command("<query>", "Discover", readonly=True)
+def grep(mastodon, rest):
+    """Search the toots you have seen.
+
+    Finds words anywhere in a toot's text, author, hashtags and links.
+    Narrow down with:
+        from:@user   toots by user (or from:@user@instance)
+        tag:name     toots with hashtag name
+        has:media    toots with media (also has:poll, has:cw, has:link)
+
+    Shows the newest 20 matches; add a number for more (ex: grep cats 40).
+
+    ex: grep tootstream
+        grep from:@alice has:media
+        grep tag:caturday tabby"""
+    if not SEARCH.is_open:
+        cprint("The search index is disabled (--no-cache).", fg("red"))
+        raise AlreadyPrintedException
+    words = rest.split()
+    limit = 20
+    if len(words) > 1 and words[-1].isdigit():
+        limit = int(words.pop())
+    if not words:
+        cprint("  usage: grep <query>", fg("red"))
+        raise AlreadyPrintedException
+    query = " ".join(words)
+    results = SEARCH.search(query, limit)
+    if not results:
+        cprint("No toots found for {}.".format(query), fg("red"))
+        return
+    print_toots(
+        mastodon, results, ctx_name="grep {}".format(query), add_completion=False
+    )
+
+
+@command("<user> [<N>]", "Discover", readonly=True)
 def user(mastodon, rest):
     """Displays profile information for another user
 
@@ -2060,7 +3567,7 @@ def user(mastodon, rest):
     raise Exception("user {rest} not found")
 
 
-@command("<user> [<N>]", "Discover")
+@command("<user> [<N>]", "Discover", readonly=True)
 def view(mastodon, rest):
     """Displays toots from another user.
 
@@ -2070,7 +3577,6 @@ def view(mastodon, rest):
     ex: view 23
         view @user 10
         view @user@instance.example.com"""
-    global LAST_PAGE, LAST_CONTEXT
     (user, _, count) = rest.partition(" ")
 
     # validate count argument
@@ -2083,25 +3589,27 @@ def view(mastodon, rest):
             raise ValueError("  invalid count: {count}")
 
     userid = get_unique_userid(mastodon, user, exact=False)
-    LAST_PAGE = mastodon.account_statuses(userid, limit=count)
-    LAST_CONTEXT = f"{user} timeline"
-    print_toots(mastodon, LAST_PAGE, ctx_name=LAST_CONTEXT, add_completion=False)
+    context = f"{user} timeline"
+    page = load_page(
+        mastodon, context, lambda: mastodon.account_statuses(userid, limit=count)
+    )
+    print_toots(mastodon, page, ctx_name=context, add_completion=False)
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def info(mastodon, rest):
     """Prints your user info."""
-    user = mastodon.account_verify_credentials()
+    user = CREDENTIALS.get(mastodon, refresh=True)
     printUser(user)
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def followers(mastodon, rest):
     """Lists users who follow you."""
     # TODO: compare user['followers_count'] to len(users)
     #       request more from server if first call doesn't get full list
     # TODO: optional username/userid to show another user's followers?
-    user = mastodon.account_verify_credentials()
+    user = CREDENTIALS.get(mastodon)
     limit, rest = limit_flag(rest)
     users = mastodon.fetch_remaining(mastodon.account_followers(user["id"], limit=limit))
     if not users:
@@ -2111,13 +3619,13 @@ def followers(mastodon, rest):
         printUsersShort(users)
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def following(mastodon, rest):
     """Lists users you follow."""
     # TODO: compare user['following_count'] to len(users)
     #       request more from server if first call doesn't get full list
     # TODO: optional username/userid to show another user's following?
-    user = mastodon.account_verify_credentials()
+    user = CREDENTIALS.get(mastodon)
     limit, rest = limit_flag(rest)
     users = mastodon.fetch_remaining(mastodon.account_following(user["id"], limit=limit))
     if not users:
@@ -2127,7 +3635,7 @@ def following(mastodon, rest):
         printUsersShort(users)
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def blocks(mastodon, rest):
     """Lists users you have blocked."""
     limit, rest = limit_flag(rest)
@@ -2139,7 +3647,7 @@ def blocks(mastodon, rest):
         printUsersShort(users)
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def domainblocks(mastodon, rest):
     """Lists domains you have blocked."""
     limit, rest = limit_flag(rest)
@@ -2152,7 +3660,7 @@ def domainblocks(mastodon, rest):
             cprint("  " + domain, fg('cyan'))
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def mutes(mastodon, rest):
     """Lists users you have muted."""
     limit, rest = limit_flag(rest)
@@ -2164,7 +3672,7 @@ def mutes(mastodon, rest):
         printUsersShort(users)
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def requests(mastodon, rest):
     """Lists your incoming follow requests.
 
@@ -2202,7 +3710,7 @@ def reject(mastodon, rest):
     cprint(f"  user {rest}'s follow request is rejected", fg("blue"))
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def faves(mastodon, rest):
     """Displays posts you've favourited."""
     print_toots(
@@ -2210,7 +3718,7 @@ def faves(mastodon, rest):
     )
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def bookmarks(mastodon, rest):
     """Displays posts you've bookmarked."""
     print_toots(
@@ -2218,12 +3726,12 @@ def bookmarks(mastodon, rest):
     )
 
 
-@command("[<N>]", "Profile")
+@command("[<N>]", "Profile", readonly=True)
 def me(mastodon, rest):
     """Displays toots you've tooted.
 
     <N>:   (optional) show N toots maximum"""
-    itme = mastodon.account_verify_credentials()
+    itme = CREDENTIALS.get(mastodon)
     # no specific API for user's own timeline
     # let view() do the work
     view(mastodon, "{} {}".format(itme["id"], rest))
@@ -2232,11 +3740,11 @@ def me(mastodon, rest):
 me.__section__ = "Profile"
 
 
-@command("", "Profile")
+@command("", "Profile", readonly=True)
 def about(mastodon, rest):
     """Shows version information and connected instance"""
-    print("Tootstream version: %s" % version)
-    print("You are connected to ", end="")
+    tprint("Tootstream version: %s" % get_version())
+    tprint("You are connected to ", end="")
     cprint(mastodon.api_base_url, fg("green") + attr("bold"))
 
 
@@ -2252,11 +3760,11 @@ def exit(mastodon, rest):
     sys.exit("Goodbye!")
 
 
-@command("", "List")
+@command("", "List", readonly=True)
 def lists(mastodon, rest):
     """Shows the lists that the user has created."""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     user_lists = mastodon.lists()
     if len(user_lists) == 0:
         cprint("No lists found", fg("red"))
@@ -2269,7 +3777,7 @@ def lists(mastodon, rest):
 def listcreate(mastodon, rest):
     """Creates a list."""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     mastodon.list_create(rest)
     cprint("List {} created.".format(rest), fg("green"))
 
@@ -2279,15 +3787,15 @@ def listrename(mastodon, rest):
     """Rename a list.
     ex:  listrename oldlist newlist"""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     rest = rest.strip()
     if not rest:
         cprint("Argument required.", fg("red"))
-        return
+        raise AlreadyPrintedException
     items = rest.split(" ")
     if len(items) < 2:
         cprint("Not enough arguments.", fg("red"))
-        return
+        raise AlreadyPrintedException
 
     list_id = get_list_id(mastodon, items[0])
     updated_name = items[1]
@@ -2302,47 +3810,47 @@ def listdestroy(mastodon, rest):
     ex: listdestroy listname
         listdestroy 23"""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     item = get_list_id(mastodon, rest)
 
     mastodon.list_delete(item)
     cprint("List {} deleted.".format(rest), fg("green"))
 
 
-@command("<list>", "List")
+@command("<list>", "List", readonly=True)
 def listhome(mastodon, rest):
     """Show the toots from a list.
     ex:  listhome listname
          listhome 23"""
-    global LAST_PAGE, LAST_CONTEXT
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     if not rest:
         cprint("Argument required.", fg("red"))
-        return
+        raise AlreadyPrintedException
     stepper, rest = step_flag(rest)
     limit, list_name = rest_limit(rest)
     item = get_list_id(mastodon, list_name)
-    LAST_PAGE = mastodon.timeline_list(item, limit=limit)
-    LAST_CONTEXT = f"list ({list_name})"
-    print_toots(mastodon, LAST_PAGE, stepper, limit, ctx_name=LAST_CONTEXT)
+    context = f"list ({list_name})"
+    page = load_page(
+        mastodon, context, timeline_loader(mastodon, "list:{}".format(item), limit)
+    )
+    print_toots(mastodon, page, stepper, limit, ctx_name=context)
 
 
-@command("<list>", "List")
+@command("<list>", "List", readonly=True)
 def listaccounts(mastodon, rest):
     """Show the accounts for the list.
     ex:  listaccounts listname
          listaccounts 23"""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     item = get_list_id(mastodon, rest)
     list_accounts = mastodon.fetch_remaining(mastodon.list_accounts(item))
 
     cprint("List: %s" % rest, fg("green"))
     for user in list_accounts:
         username = "@" + user.get("acct")
-        if username not in completion_list:
-            bisect.insort(completion_list, username)
+        completions.add(username)
         printUser(user)
 
 
@@ -2352,14 +3860,14 @@ def listadd(mastodon, rest):
     ex:  listadd listname @user@instance.example.com
          listadd 23 @user@instance.example.com"""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     if not rest:
         cprint("Argument required.", fg("red"))
-        return
+        raise AlreadyPrintedException
     items = rest.split(" ")
     if len(items) < 2:
         cprint("Not enough arguments.", fg("red"))
-        return
+        raise AlreadyPrintedException
 
     list_id = get_list_id(mastodon, items[0])
     account_id = get_unique_userid(mastodon, items[1])
@@ -2374,14 +3882,14 @@ def listremove(mastodon, rest):
          listremove 23 user@instance.example.com
          listremove 23 42"""
     if not (list_support(mastodon)):
-        return
+        raise AlreadyPrintedException
     if not rest:
         cprint("Argument required.", fg("red"))
-        return
+        raise AlreadyPrintedException
     items = rest.split(" ")
     if len(items) < 2:
         cprint("Not enough arguments.", fg("red"))
-        return
+        raise AlreadyPrintedException
 
     list_id = get_list_id(mastodon, items[0])
     account_id = get_unique_userid(mastodon, items[1])
@@ -2402,7 +3910,7 @@ def authenticated(mastodon):
     return True
 
 
-def get_mastodon(instance, config, profile):
+def get_mastodon(instance, config, profile, cache=True):
     configpath = os.path.expanduser(config)
     if os.path.isfile(configpath) and not os.access(configpath, os.W_OK):
         # warn the user before they're asked for input
@@ -2431,11 +3939,25 @@ def get_mastodon(instance, config, profile):
         cprint("Could not log you in.  Please try again later.", fg("red"))
         sys.exit(1)
 
+    api_base_url = "https://" + instance
+    if cache:
+        try:
+            SESSION.open(get_state_path(configpath, profile, ".session"))
+        except Exception as e:
+            cprint("Unable to open the session snapshot: {}".format(e), fg("red"))
+        if SESSION.get("instance") != api_base_url:
+            SESSION.clear()
+
+    # Use the instance version from the snapshot if there is one, otherwise
+    # list_support() checks the version when it's first needed
+    mastodon_version = SESSION.get("version")
     mastodon = Mastodon(
         client_id=client_id,
         client_secret=client_secret,
         access_token=token,
-        api_base_url="https://" + instance,
+        api_base_url=api_base_url,
+        mastodon_version=mastodon_version,
+        version_check_mode="none" if mastodon_version is None else "created",
     )
 
     # update config before writing
@@ -2451,6 +3973,105 @@ def get_mastodon(instance, config, profile):
     return (mastodon, profile)
 
 
+class OutputRouter:
+    """Stands in for sys.stdout in batch mode.  Output of a thread that has
+    an output buffer goes there, everything else to `stream`."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(_thread_state, "output", None)
+        return (buffer or self.stream).write(text)
+
+    def flush(self):
+        if getattr(_thread_state, "output", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_command(mastodon, line):
+    """Run one command line.  Returns False if the command failed."""
+    command, _, rest = line.partition(" ")
+    cmd_func = commands.get(command)
+    if cmd_func is None:
+        cprint(__friendly_cmd_error__.format(command), fg("red"))
+        return False
+    try:
+        cmd_func(mastodon, rest)
+    except AlreadyPrintedException:
+        return False
+    except Exception as e:
+        cprint(e, fg("red"))
+        return False
+    return True
+
+
+def run_buffered(mastodon, line):
+    """Run a command line collecting its output and the pages it loads.
+    Returns (succeeded, output, pages)."""
+    _thread_state.output = io.StringIO()
+    _thread_state.pages = []
+    try:
+        ok = run_command(mastodon, line)
+        return ok, _thread_state.output.getvalue(), _thread_state.pages
+    finally:
+        _thread_state.output = None
+        _thread_state.pages = None
+
+
+def run_script(mastodon, lines, workers=BATCH_WORKERS):
+    """Run command lines in order, as if typed at the prompt.  Returns the
+    number of commands that failed.
+
+    Consecutive readonly commands run concurrently (but never the same
+    command twice at once); their output is written in the order they
+    were given, and the page loaded by the last of them becomes the current
+    page for 'next' and 'prev'.  Other commands run on their own.
+
+    Nobody reads ahead in a script, so pages aren't prefetched."""
+    PREFETCHER.enabled = False
+    failures = 0
+    group = []
+
+    def run_group():
+        nonlocal failures
+        if len(group) == 1:
+            failures += not run_command(mastodon, group[0])
+        elif group:
+            run = functools.partial(run_buffered, mastodon)
+            with ThreadPoolExecutor(max_workers=min(workers, len(group))) as pool:
+                results = list(pool.map(run, group))
+            last_page = None
+            for ok, output, pages in results:
+                failures += not ok
+                sys.stdout.write(output)
+                if pages:
+                    last_page = pages[-1]
+            if last_page is not None:
+                context, page, loader = last_page
+                PAGES.reset(context, page, loader)
+                set_page(mastodon, page, context)
+        sys.stdout.flush()
+        group.clear()
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        name = line.split(" ", 1)[0]
+        readonly = getattr(commands.get(name), "__readonly__", False)
+        if not readonly or name in (other.split(" ", 1)[0] for other in group):
+            run_group()
+        group.append(line)
+        if not readonly:
+            run_group()
+    run_group()
+    return failures
+
+
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
 
@@ -2473,8 +4094,112 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
     default="default",
     help="Name of profile for saved credentials (default)",
 )
-def main(instance, config, profile):
-    mastodon, profile = get_mastodon(instance, config, profile)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Keep seen toots and their IDs in local files next to the configuration file",
+)
+@click.option(
+    "--stream-queue",
+    "queue_size",
+    metavar="<n>",
+    type=click.IntRange(min=1),
+    default=stream_queue_size,
+    show_default=True,
+    help="Number of streamed toots that may wait to be shown",
+)
+@click.option(
+    "--stream-overflow",
+    "overflow",
+    type=click.Choice(OVERFLOW_POLICIES),
+    help="What to do with streamed toots when the queue is full"
+    " [default: {}, or block with --output ndjson]".format(stream_overflow),
+)
+@click.option(
+    "--stream-fps",
+    "fps",
+    metavar="<n>",
+    type=click.IntRange(min=1),
+    default=stream_fps,
+    show_default=True,
+    help="Maximum number of screen updates per second while streaming",
+)
+@click.option(
+    "--batch",
+    "-b",
+    metavar="<file>",
+    type=click.File("r"),
+    help="Run the commands in file (one per line, - for stdin) and exit",
+)
+@click.option(
+    "--execute",
+    "-e",
+    metavar="<command>",
+    multiple=True,
+    help="Run a command and exit (may be given more than once)",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output",
+    type=click.Choice(OUTPUT_FORMATS),
+    default=output_format,
+    show_default=True,
+    help="Print toots, notifications and users as text or as JSON lines",
+)
+def main(
+    instance,
+    config,
+    profile,
+    cache,
+    queue_size,
+    overflow,
+    fps,
+    batch,
+    execute,
+    output,
+):
+    global stream_queue_size, stream_overflow, stream_fps, output_format
+    stream_queue_size = queue_size
+    if overflow is None:
+        overflow = "block" if output == "ndjson" else stream_overflow
+    stream_overflow = overflow
+    stream_fps = fps
+    output_format = output
+
+    mastodon, profile = get_mastodon(instance, config, profile, cache)
+
+    if cache:
+        try:
+            STATUS_CACHE.open(get_state_path(config, profile, ".db"))
+        except Exception as e:
+            cprint("Unable to open the toot cache: {}".format(e), fg("red"))
+        try:
+            IDS.open(get_state_path(config, profile, ".ids"))
+        except Exception as e:
+            cprint("Unable to open the toot ID file: {}".format(e), fg("red"))
+        try:
+            STORE.open(get_state_path(config, profile, ".db"))
+        except Exception as e:
+            cprint("Unable to open the timeline store: {}".format(e), fg("red"))
+        try:
+            SEARCH.open(get_state_path(config, profile, ".db"))
+            atexit.register(SEARCH.close)
+        except Exception as e:
+            cprint("Unable to open the search index: {}".format(e), fg("red"))
+        try:
+            FOLLOWING.open(get_state_path(config, profile, ".db"))
+            atexit.register(FOLLOWING.close)
+        except Exception as e:
+            cprint("Unable to open the following index: {}".format(e), fg("red"))
+
+    if batch is not None or execute:
+        # batch mode: no prompt, readline or completion, exit status 1 if
+        # any command failed
+        lines = list(batch) if batch is not None else []
+        lines.extend(execute)
+        sys.stdout = OutputRouter(sys.stdout)
+        sys.exit(1 if run_script(mastodon, lines) else 0)
 
     def say_error(a, b):
         return cprint(
@@ -2484,26 +4209,29 @@ def main(instance, config, profile):
 
     about(mastodon, "")
 
-    print("Enter a command. Use 'help' for a list of commands.")
-    print("\n")
-
-    user = mastodon.account_verify_credentials()
+    tprint("Enter a command. Use 'help' for a list of commands.")
+    tprint("\n")
+
+    # Only our account is needed for the prompt.  With a session snapshot
+    # the prompt is shown straight away and the snapshot is checked in the
+    # background; without one we fetch the account and fill in completions
+    # in the background.
+    user = restore_session()
+    if user is None:
+        user = CREDENTIALS.get(mastodon)
+        run_in_background("refresh the session", refresh_session, mastodon, user)
+    else:
+        run_in_background("refresh the session", refresh_session, mastodon)
     username = str(user.get("username"))
     prompt = update_prompt(username=username, context=LAST_CONTEXT, profile=profile)
 
     # Completion setup stuff
-    if list_support(mastodon, silent=True):
-        for i in mastodon.lists():
-            bisect.insort(completion_list, i["title"].lower())
-
-    for i in mastodon.account_following(user["id"], limit=80):
-        bisect.insort(completion_list, "@" + i["acct"])
     readline.set_completer(complete)
     readline.parse_and_bind("tab: complete")
     readline.set_completer_delims(" ")
 
     while True:
-        command = input(prompt).split(" ", 1)
+        command = read_input(prompt).split(" ", 1)
         rest = ""
         try:
             rest = command[1]
@@ -0,0 +1,174 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from dateutil.parser import isoparse
+from mastodon import AttribAccessDict
+
+# Keys holding timestamps in Mastodon entities.  JSON only knows strings, so
+# these are turned back into datetimes when a status is loaded.
+DATETIME_KEYS = (
+    "created_at",
+    "edited_at",
+    "expires_at",
+    "last_status_at",
+    "updated_at",
+    "scheduled_at",
+)
+
+# AttribAccessDict.__setitem__ looks up type hints for every key in newer
+# versions of Mastodon.py and is very slow, so items are set with the method
+# of the mapping it is based on.  (In those versions that's an OrderedDict,
+# and dict.__setitem__ would leave them out of iteration.)
+if issubclass(AttribAccessDict, OrderedDict):
+    _set_item = OrderedDict.__setitem__
+else:
+    _set_item = dict.__setitem__
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(
+        "Object of type {} is not JSON serializable".format(type(value).__name__)
+    )
+
+
+def _json_object_hook(obj):
+    for key in DATETIME_KEYS:
+        value = obj.get(key)
+        if isinstance(value, str):
+            try:
+                obj[key] = isoparse(value)
+            except ValueError:
+                pass
+    entity = AttribAccessDict()
+    for key, value in obj.items():
+        _set_item(entity, key, value)
+    return entity
+
+
+def dump_status(status):
+    """Serialize a status (or any Mastodon entity) to compact JSON."""
+    return json.dumps(status, default=_json_default, separators=(",", ":"))
+
+
+def load_status(text):
+    """Deserialize JSON produced by dump_status() or sent by the Mastodon API.
+
+    Objects support attribute access and timestamps are converted to
+    datetimes, the same as entities returned by Mastodon.py.
+    """
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+class StatusCache:
+    """
+    StatusCache keeps statuses we have already received so per-toot commands
+    don't need to ask the server for them again.
+
+    Statuses are keyed by their global (mastodon) ID.  The most recently used
+    statuses are kept in memory, evicting the least recently used ones once
+    more than `size` statuses are cached.
+
+    Calling open() additionally stores statuses in a SQLite database so they
+    survive restarts.  Only the newest `max_rows` rows are kept on disk.
+
+    The cache may be used from the stream listener's thread and the main
+    thread at the same time.
+
+      size - The maximum number of statuses to keep in memory.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+    def open(self, path, max_rows=20000):
+        """Back the cache by the SQLite database at path."""
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS statuses "
+            "(id TEXT PRIMARY KEY, data TEXT NOT NULL, seen REAL NOT NULL)"
+        )
+        db.execute(
+            "DELETE FROM statuses WHERE id NOT IN "
+            "(SELECT id FROM statuses ORDER BY seen DESC LIMIT ?)",
+            (max_rows,),
+        )
+        db.commit()
+        with self._lock:
+            self._db = db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get(self, status_id):
+        """Returns the cached status for a global ID or None."""
+        key = str(status_id)
+        with self._lock:
+            status = self._statuses.get(key)
+            if status is not None:
+                self._statuses.move_to_end(key)
+                return status
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT data FROM statuses WHERE id = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            status = load_status(row[0])
+            self._remember(key, status)
+            return status
+
+    def put(self, status):
+        """Add or replace a status (and the toot it boosts)."""
+        self.put_many([status])
+
+    def put_many(self, statuses):
+        """Add or replace several statuses with a single database write."""
+        rows = []
+        now = time.time()
+        with self._lock:
+            for status in statuses:
+                if not status:
+                    continue
+                for item in (status, status.get("reblog")):
+                    if not item or item.get("id") is None:
+                        continue
+                    key = str(item["id"])
+                    self._remember(key, item)
+                    if self._db is not None:
+                        rows.append((key, dump_status(item), now))
+            if rows:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO statuses (id, data, seen) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._db.commit()
+
+    def discard(self, status_id):
+        """Forget a status, e.g. after it has been deleted or changed."""
+        key = str(status_id)
+        with self._lock:
+            self._statuses.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM statuses WHERE id = ?", (key,))
+                self._db.commit()
+
+    def _remember(self, key, status):
+        self._statuses[key] = status
+        self._statuses.move_to_end(key)
+        while len(self._statuses) > self.size:
+            self._statuses.popitem(last=False)
@@ -0,0 +1,196 @@
+import sqlite3
+import threading
+
+
+def page_cursor(page, direction):
+    """Returns the ID to continue paging from in direction ("next" for
+    older, "prev" for newer), from the Link header Mastodon.py attached to
+    a page, or None."""
+    info = getattr(page, "_pagination_" + direction, None) or {}
+    for key in ("max_id",) if direction == "next" else ("min_id", "since_id"):
+        if info.get(key) is not None:
+            return str(info[key])
+    return None
+
+
+class FollowingIndex:
+    """
+    FollowingIndex keeps the accounts we follow in a SQLite database, so
+    completion knows all of them without fetching the whole list on every
+    launch.
+
+    The following list is paged newest follow first, with cursors that
+    aren't account IDs, so the index stores the cursors along with the
+    accounts.  Each account is tagged with the walk (full pass through the
+    list) that last saw it; accounts not seen by a finished walk were
+    unfollowed.
+
+    The index may be used from a background thread and the main thread at
+    the same time.  Once it is closed, e.g. at exit while a sync is still
+    running, nothing more is stored.
+    """
+
+    def __init__(self):
+        self._db = None
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS following ("
+            "id TEXT PRIMARY KEY, acct TEXT NOT NULL, walk INTEGER NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS following_state ("
+            "key TEXT PRIMARY KEY, value TEXT)"
+        )
+        db.commit()
+        with self._lock:
+            self._db = db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @property
+    def is_open(self):
+        return self._db is not None
+
+    def accts(self):
+        """Returns the accts of the stored accounts."""
+        with self._lock:
+            rows = self._db.execute("SELECT acct FROM following").fetchall()
+        return [row[0] for row in rows]
+
+    def count(self):
+        with self._lock:
+            if self._db is None:
+                return 0
+            return self._db.execute("SELECT COUNT(*) FROM following").fetchone()[0]
+
+    def get_state(self, key):
+        with self._lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT value FROM following_state WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, **values):
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.executemany(
+                "INSERT OR REPLACE INTO following_state (key, value) VALUES (?, ?)",
+                [(key, None if v is None else str(v)) for key, v in values.items()],
+            )
+            self._db.commit()
+
+    def add(self, accounts, walk):
+        """Store accounts as seen by walk.  Returns the accts that weren't
+        stored yet."""
+        with self._lock:
+            if self._db is None:
+                return []
+            new = [
+                account["acct"]
+                for account in accounts
+                if self._db.execute(
+                    "SELECT 1 FROM following WHERE id = ?", (str(account["id"]),)
+                ).fetchone()
+                is None
+            ]
+            self._db.executemany(
+                "INSERT OR REPLACE INTO following (id, acct, walk) VALUES (?, ?, ?)",
+                [(str(a["id"]), a["acct"], walk) for a in accounts],
+            )
+            self._db.commit()
+        return new
+
+    def remove_unseen(self, walk):
+        """Delete the accounts a finished walk didn't see and return their
+        accts."""
+        with self._lock:
+            if self._db is None:
+                return []
+            rows = self._db.execute(
+                "SELECT acct FROM following WHERE walk < ?", (walk,)
+            ).fetchall()
+            self._db.execute("DELETE FROM following WHERE walk < ?", (walk,))
+            self._db.commit()
+        return [row[0] for row in rows]
+
+
+def sync_following(index, fetch, expected=None, limit=80, on_update=None):
+    """Bring the index up to date with the following list.
+
+    fetch is account_following for our account, taking max_id, min_id and
+    limit.  When the list was walked before, only follows newer than the
+    newest stored one are fetched.  All of it is walked again (continuing
+    an interrupted walk where it stopped) when there is no finished walk
+    yet, or when expected, our account's following count, shows that
+    accounts were unfollowed.  Servers may count accounts they don't list,
+    so only a change in the difference to the count at the end of the last
+    walk counts.
+
+    on_update(added, removed) is called with accts as each page is stored.
+    Returns the number of requests made."""
+    requests = 0
+    walk = int(index.get_state("walk") or 0)
+    cursor = index.get_state("next")
+    newest = index.get_state("newest")
+
+    if cursor is None and newest is not None:
+        while True:
+            page = fetch(min_id=newest, limit=limit)
+            requests += 1
+            if not page:
+                break
+            added = index.add(page, walk)
+            if on_update is not None:
+                on_update(added, [])
+            # a short page doesn't mean the end: the server may have left
+            # out accounts, so page until there is no newer cursor
+            cursor = page_cursor(page, "prev")
+            if cursor is None or cursor == newest:
+                break
+            newest = cursor
+            index.set_state(newest=newest)
+        cursor = None
+        offset = index.get_state("offset")
+        if expected is None or offset is None:
+            return requests
+        if expected - index.count() == int(offset):
+            return requests
+
+    if cursor is None:
+        # start a new walk
+        walk += 1
+        cursor = ""
+        index.set_state(walk=walk, next=cursor)
+
+    while True:
+        page = fetch(max_id=cursor or None, limit=limit) or []
+        requests += 1
+        if not cursor:
+            newest = page_cursor(page, "prev")
+            index.set_state(newest=newest)
+        added = index.add(page, walk)
+        if on_update is not None:
+            on_update(added, [])
+        cursor = page_cursor(page, "next")
+        if not page or cursor is None:
+            break
+        index.set_state(next=cursor)
+
+    removed = index.remove_unseen(walk)
+    if on_update is not None and removed:
+        on_update([], removed)
+    offset = None if expected is None else expected - index.count()
+    index.set_state(next=None, offset=offset)
+    return requests
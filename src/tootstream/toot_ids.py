@@ -0,0 +1,182 @@
+import contextlib
+import fcntl
+import mmap
+import os
+import struct
+
+MAGIC = b"TSIDS\x00\x01\x00"
+# magic, local ID of the first record
+HEADER = struct.Struct("<8sQ")
+# Each record is one global ID, NUL padded.  Mastodon and Pleroma IDs are
+# well under this; longer IDs are written as an empty record so the record
+# numbers still line up with the local IDs.
+RECORD_SIZE = 32
+
+
+class IdFile:
+    """
+    IdFile stores the local (tootstream) to global (mastodon) ID mappings
+    on disk so local IDs stay valid across restarts.
+
+    The file is append-only: a small header followed by fixed size records,
+    where record N holds the global ID for local ID `base + N`.  Opening the
+    file memory-maps it rather than reading it, so it behaves like an array
+    of global IDs that is paged in only where it is accessed.  Startup cost
+    doesn't depend on how many IDs have been stored.
+
+    When the file holds more than `max_records` records it is rewritten
+    keeping only the newest `keep_records`; local IDs don't change.
+
+    Several processes (say a session and a --batch run of the same profile)
+    may use the file at once.  Appending and rewriting hold an exclusive
+    flock on it, a record's local ID follows from where it landed in the
+    file, and a process that finds the file rewritten by another one opens
+    the new file before appending.
+
+      path - The file to use, created if it doesn't exist.
+    """
+
+    def __init__(self, path, max_records=1000000, keep_records=100000):
+        self.path = path
+        self.max_records = max_records
+        self.keep_records = keep_records
+        self._map = None
+        self._reader = None
+        self._appender = None
+        try:
+            self._open()
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self):
+        """Open the file, rewriting it first if it has grown too large."""
+        while True:
+            self._appender = open(self.path, "ab", buffering=0)
+            with self._locked():
+                # another process may have rewritten it before we got the lock
+                if not self._replaced():
+                    self._load()
+                    if self._count <= self.max_records:
+                        if self._count:
+                            self._map = mmap.mmap(
+                                self._reader.fileno(), 0, access=mmap.ACCESS_READ
+                            )
+                        self._mapped = self._count
+                        return
+                    self._compact(self.keep_records)
+            # continue in the new file
+            self.close()
+
+    def _load(self):
+        """Read the header and count the records, with the lock held."""
+        if os.fstat(self._appender.fileno()).st_size < HEADER.size:
+            self._appender.truncate(0)
+            self._appender.write(HEADER.pack(MAGIC, 0))
+
+        self._reader = open(self.path, "rb")
+        magic, self.base = HEADER.unpack(self._reader.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a tootstream ID file".format(self.path))
+
+        # ignore a partially written record at the end; nobody else is
+        # writing while we hold the lock
+        size = os.fstat(self._reader.fileno()).st_size
+        self._count = (size - HEADER.size) // RECORD_SIZE
+        if size != HEADER.size + self._count * RECORD_SIZE:
+            self._appender.truncate(HEADER.size + self._count * RECORD_SIZE)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the exclusive lock on the file."""
+        fd = self._appender.fileno()
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _replaced(self):
+        """Returns whether the file was rewritten since we opened it."""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._appender.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def get(self, local_id):
+        """Returns the stored global ID for a local ID, or None."""
+        index = local_id - self.base
+        if index >= self._count:
+            # it may have been appended by another process
+            size = os.fstat(self._reader.fileno()).st_size
+            self._count = (size - HEADER.size) // RECORD_SIZE
+        if index < 0 or index >= self._count:
+            return None
+        offset = HEADER.size + index * RECORD_SIZE
+        if index < self._mapped:
+            record = self._map[offset : offset + RECORD_SIZE]
+        else:
+            # appended since the file was mapped
+            self._reader.seek(offset)
+            record = self._reader.read(RECORD_SIZE)
+        record = record.rstrip(b"\x00")
+        return record.decode() if record else None
+
+    def recent(self, count):
+        """Returns (local ID, global ID) pairs for the last `count` records
+        present when the file was opened, oldest first."""
+        first = max(self._mapped - count, 0)
+        start = HEADER.size + first * RECORD_SIZE
+        end = HEADER.size + self._mapped * RECORD_SIZE
+        data = self._map[start:end] if self._map is not None else b""
+        out = []
+        local_id = self.base + first
+        for offset in range(0, len(data), RECORD_SIZE):
+            record = data[offset : offset + RECORD_SIZE].rstrip(b"\x00")
+            if record:
+                out.append((local_id, record.decode()))
+            local_id += 1
+        return out
+
+    def append(self, global_id):
+        """Store a global ID and return the local ID it got."""
+        record = str(global_id).encode()
+        if len(record) > RECORD_SIZE:
+            record = b""
+        record = record.ljust(RECORD_SIZE, b"\x00")
+        while True:
+            with self._locked():
+                if not self._replaced():
+                    self._appender.write(record)
+                    # records are only written under the lock, so ours is
+                    # the last one
+                    size = os.fstat(self._appender.fileno()).st_size
+                    self._count = (size - HEADER.size) // RECORD_SIZE
+                    return self.base + self._count - 1
+            # rewritten by another process
+            self.close()
+            self._open()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._appender is not None:
+            self._appender.close()
+            self._appender = None
+
+    def _compact(self, keep_records):
+        drop = self._count - keep_records
+        with open(self.path, "rb") as f:
+            f.seek(HEADER.size + drop * RECORD_SIZE)
+            records = f.read()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.base + drop))
+            f.write(records)
+        os.replace(tmp_path, self.path)
+        self.base += drop
+        self._count = keep_records
@@ -1,4 +1,4 @@
-import emoji
+import re
 from colored import attr
 from html.parser import HTMLParser
 from textwrap import TextWrapper
@@ -9,6 +9,77 @@ def unique(sequence):
     return [x for x in sequence if not (x in seen or seen.add(x))]
 
 
+# Lookup tables for emoji conversion, built from the emoji package the
+# first time they are needed.
+_shortcode_to_unicode = None
+_unicode_to_shortcode = None
+_emoji_starts = None
+_emoji_max_len = 0
+
+_SHORTCODE_RE = re.compile(r":[^:\s]+:")
+# Runs of text that may contain emoji.  Keycap emoji start with an ASCII
+# character, everything else is outside ASCII.
+_EMOJI_RUN_RE = re.compile(r"[#*0-9]?[^\x00-\x7f]+")
+
+
+def _emoji_tables():
+    """Build the shortcode and unicode lookup tables.  The emoji package
+    has changed its data layout over time, so support the known ones."""
+    global _shortcode_to_unicode, _unicode_to_shortcode
+    global _emoji_starts, _emoji_max_len
+    # imported here as it takes a while and is only needed for conversion
+    import emoji
+
+    to_unicode = {}
+    to_shortcode = {}
+    emoji_data = getattr(emoji, "EMOJI_DATA", None)
+    if emoji_data:
+        # emoji >= 1.7
+        for char, info in emoji_data.items():
+            name = info.get("en")
+            if not name:
+                continue
+            to_shortcode[char] = name
+            to_unicode.setdefault(name, char)
+            for alias in info.get("alias", ()):
+                to_unicode.setdefault(alias, char)
+    elif hasattr(emoji, "EMOJI_ALIAS_UNICODE_ENGLISH"):
+        # emoji 1.x
+        to_unicode.update(emoji.EMOJI_ALIAS_UNICODE_ENGLISH)
+        to_shortcode.update(emoji.UNICODE_EMOJI_ENGLISH)
+    else:
+        # emoji 0.x
+        to_unicode.update(emoji.EMOJI_ALIAS_UNICODE)
+        to_shortcode.update(emoji.UNICODE_EMOJI)
+
+    _emoji_starts = frozenset(char[0] for char in to_shortcode)
+    _emoji_max_len = max(len(char) for char in to_shortcode)
+    _shortcode_to_unicode = to_unicode
+    _unicode_to_shortcode = to_shortcode
+
+
+def _demojize_run(match):
+    """Replace the emoji in a run of non-ASCII text, longest match first."""
+    run = match.group(0)
+    out = []
+    i = 0
+    while i < len(run):
+        if run[i] in _emoji_starts:
+            for size in range(min(_emoji_max_len, len(run) - i), 0, -1):
+                name = _unicode_to_shortcode.get(run[i : i + size])
+                if name is not None:
+                    out.append(name)
+                    i += size
+                    break
+            else:
+                out.append(run[i])
+                i += 1
+        else:
+            out.append(run[i])
+            i += 1
+    return "".join(out)
+
+
 def emoji_shortcode_to_unicode(text):
     """Convert standard emoji short codes to unicode emoji in
     the provided text.
@@ -16,12 +87,24 @@ def emoji_shortcode_to_unicode(text):
       text - The text to parse.
       Returns the modified text.
     """
-    return emoji.emojize(text, use_aliases=True)
+    # fast path: no short codes without colons
+    if ":" not in text:
+        return text
+    if _shortcode_to_unicode is None:
+        _emoji_tables()
+    return _SHORTCODE_RE.sub(
+        lambda m: _shortcode_to_unicode.get(m.group(0), m.group(0)), text
+    )
 
 
 def emoji_unicode_to_shortcodes(text):
     """Convert unicode emoji to standard emoji short codes."""
-    return emoji.demojize(text)
+    # fast path: plain ASCII text has no emoji
+    if text.isascii():
+        return text
+    if _unicode_to_shortcode is None:
+        _emoji_tables()
+    return _EMOJI_RUN_RE.sub(_demojize_run, text)
 
 
 def find_attr(name, attrs):
@@ -73,7 +156,8 @@ class TootParser(HTMLParser):
 
     Emoji short codes can optionally be converted into unicode based emoji by
     enabling the convert_emoji parameter.  This parses standard emoji short
-    code names and does not support custom emojo short codes.
+    code names and does not support custom emojo short codes.  Conversion
+    is done once on the whole text when get_text() is called.
 
     Styles can also optionally be applied to links found in the source text.
     Pass in the desired colored style to the link_style, mention_style, and
@@ -152,12 +236,6 @@ class TootParser(HTMLParser):
         if self.hide:
             return
 
-        if self.convert_emoji_to_unicode:
-            data = emoji_shortcode_to_unicode(data)
-
-        if self.convert_emoji_to_shortcode:
-            data = emoji_unicode_to_shortcodes(data)
-
         self.fed.append(data)
 
     def parse_link(self, attrs):
@@ -263,6 +341,15 @@ class TootParser(HTMLParser):
         # Add the last line from the scratchpad.
         self.lines.append(self.pop_line())
 
+        if self.convert_emoji_to_unicode or self.convert_emoji_to_shortcode:
+            # Convert the whole toot at once rather than every fragment.
+            text = "\n".join(self.lines)
+            if self.convert_emoji_to_unicode:
+                text = emoji_shortcode_to_unicode(text)
+            if self.convert_emoji_to_shortcode:
+                text = emoji_unicode_to_shortcodes(text)
+            self.lines = text.split("\n")
+
         if self.wrap == None:
             return self.indent + ("\n" + self.indent).join(self.lines)
 
@@ -0,0 +1,201 @@
+import sqlite3
+import threading
+import time
+
+from tootstream.toot_cache import dump_status, load_status
+from tootstream.toot_store import sort_key
+
+# Words a 'has:' qualifier accepts, and how to tell from a status and the
+# web links (not mentions or hashtags) in its content.  A preview card often
+# isn't there yet when a toot is first seen, so links count by themselves.
+HAS = {
+    "media": lambda s, weblinks: bool(s.get("media_attachments")),
+    "poll": lambda s, weblinks: bool(s.get("poll")),
+    "cw": lambda s, weblinks: bool(s.get("spoiler_text")),
+    "link": lambda s, weblinks: bool(weblinks or s.get("card")),
+}
+
+
+def _phrase(text):
+    """Quote text as an FTS5 string so it can't be read as query syntax."""
+    return '"{}"'.format(text.replace('"', '""'))
+
+
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def parse_query(query):
+    """Split a search query into an FTS5 match expression (or None) and SQL
+    conditions with their parameters.
+
+    Words are searched for anywhere in a toot.  Supported qualifiers:
+
+      from:@user[@instance]  toots by user
+      tag:name               toots with hashtag name
+      has:media|poll|cw|link toots with media, a poll, a content warning or
+                             a link
+    """
+    terms = []
+    conditions = []
+    params = []
+    for word in query.split():
+        field, sep, value = word.partition(":")
+        field = field.lower()
+        if sep and value and field == "from":
+            acct = value.lstrip("@").lower()
+            # a bare username also matches users of that name elsewhere
+            conditions.append("(acct = ? OR acct LIKE ? ESCAPE '\\')")
+            params += [acct, _like_escape(acct) + "@%"]
+        elif sep and value and field == "tag":
+            terms.append("tags : " + _phrase(value.lstrip("#")))
+        elif sep and value and field == "has":
+            if value.lower() not in HAS:
+                raise ValueError("has: takes one of {}".format(", ".join(sorted(HAS))))
+            conditions.append("(' ' || has || ' ') LIKE ?")
+            params.append("% {} %".format(value.lower()))
+        else:
+            terms.append(_phrase(word))
+    return (" AND ".join(terms) or None), conditions, params
+
+
+class SearchIndex:
+    """
+    SearchIndex is a full-text index (SQLite FTS5) of the toots we have
+    shown, searchable by their text, author, hashtags and links.
+
+    Added toots are written in batches, when `batch_size` toots are waiting
+    or `batch_delay` seconds after the last write, and before searching.
+    Only the newest `max_rows` toots are kept.
+
+    The index may be used from the stream renderer thread and the main
+    thread at the same time.
+    """
+
+    def __init__(self, max_rows=50000, batch_size=50, batch_delay=2):
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._db = None
+        self._pending = {}
+        self._written = time.monotonic()
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS search ("
+            "rowid INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, sort TEXT NOT NULL, "
+            "acct TEXT NOT NULL, has TEXT NOT NULL, data TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS search_sort ON search (sort)")
+        db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_text "
+            "USING fts5(author, text, tags, links)"
+        )
+        with self._lock:
+            self._db = db
+            self._trim()
+            db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._write()
+                self._db.close()
+                self._db = None
+
+    @property
+    def is_open(self):
+        return self._db is not None
+
+    def add(self, status, text, links=(), weblinks=()):
+        """Index a status with its plain text and the links in it, of which
+        weblinks are the ones that aren't mentions or hashtags.  Adding a
+        status again (e.g. after an edit) replaces it."""
+        if self._db is None:
+            return
+        account = status["account"]
+        author = " ".join((account["acct"], account.get("display_name") or ""))
+        tags = " ".join(tag["name"] for tag in status.get("tags") or [])
+        has = " ".join(word for word, test in HAS.items() if test(status, weblinks))
+        row = (
+            str(status["id"]),
+            sort_key(status["id"]),
+            account["acct"].lower(),
+            has,
+            dump_status(status),
+            author,
+            text,
+            tags,
+            " ".join(links),
+        )
+        with self._lock:
+            self._pending[row[0]] = row
+            if (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._written > self.batch_delay
+            ):
+                self._write()
+
+    def search(self, query, limit=20):
+        """Returns the newest indexed statuses matching query (see
+        parse_query())."""
+        match, conditions, params = parse_query(query)
+        # find the matches first and only load the data of those shown
+        sql = "SELECT search.rowid FROM search"
+        if match is not None:
+            sql += " JOIN search_text ON search_text.rowid = search.rowid"
+            conditions = ["search_text MATCH ?"] + conditions
+            params = [match] + params
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY search.sort DESC LIMIT ?"
+        sql = "SELECT data FROM search WHERE rowid IN ({}) ORDER BY sort DESC".format(
+            sql
+        )
+        with self._lock:
+            if self._db is None:
+                return []
+            self._write()
+            rows = self._db.execute(sql, params + [limit]).fetchall()
+        return [load_status(row[0]) for row in rows]
+
+    def _write(self):
+        self._written = time.monotonic()
+        if not self._pending:
+            return
+        for row in self._pending.values():
+            old = self._db.execute(
+                "SELECT rowid FROM search WHERE id = ?", (row[0],)
+            ).fetchone()
+            if old is not None:
+                self._db.execute("DELETE FROM search_text WHERE rowid = ?", old)
+                self._db.execute("DELETE FROM search WHERE rowid = ?", old)
+            cursor = self._db.execute(
+                "INSERT INTO search (id, sort, acct, has, data) VALUES (?, ?, ?, ?, ?)",
+                row[:5],
+            )
+            self._db.execute(
+                "INSERT INTO search_text (rowid, author, text, tags, links) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid,) + row[5:],
+            )
+        self._pending.clear()
+        self._db.commit()
+
+    def _trim(self):
+        cutoff = self._db.execute(
+            "SELECT sort FROM search ORDER BY sort DESC LIMIT 1 OFFSET ?",
+            (self.max_rows,),
+        ).fetchone()
+        if cutoff is None:
+            return
+        self._db.execute(
+            "DELETE FROM search_text WHERE rowid IN "
+            "(SELECT rowid FROM search WHERE sort <= ?)",
+            cutoff,
+        )
+        self._db.execute("DELETE FROM search WHERE sort <= ?", cutoff)
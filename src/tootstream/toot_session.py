@@ -0,0 +1,71 @@
+import os
+import threading
+
+from tootstream.toot_cache import dump_status, load_status
+
+
+class SessionSnapshot:
+    """
+    SessionSnapshot keeps what tootstream fetches before the first prompt
+    (our account, the instance version, list names and the accounts we
+    follow) in a per-profile file, so the next launch can show the prompt
+    straight away and check the data in the background.
+
+    Values are Mastodon entities or plain JSON values.  The file is only
+    written when a value changed, and replaced atomically so a crash can't
+    leave half a snapshot behind.
+
+    The snapshot may be updated from a background thread while the main
+    thread reads it.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        """Use the snapshot file at path, loading it if it exists."""
+        data = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = load_status(f.read())
+            if not isinstance(data, dict):
+                raise ValueError("{} is not a tootstream session file".format(path))
+        with self._lock:
+            self.path = path
+            self._data = dict(data)
+
+    @property
+    def is_open(self):
+        return self.path is not None
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def clear(self):
+        """Forget the values; the file is replaced on the next update."""
+        with self._lock:
+            self._data = {}
+
+    def update(self, **values):
+        """Set values and write the snapshot if any of them changed.
+        Returns True if something changed."""
+        with self._lock:
+            data = dict(self._data, **values)
+            text = dump_status(data)
+            if text == dump_status(self._data):
+                return False
+            self._data = data
+            if self.path is not None:
+                self._write(text)
+            return True
+
+    def _write(self, text):
+        # it holds our account, so only we may read it, like the config
+        temp = self.path + ".tmp"
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(temp, self.path)
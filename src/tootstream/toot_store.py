@@ -0,0 +1,289 @@
+import sqlite3
+import threading
+
+from tootstream.toot_cache import dump_status, load_status
+
+
+def sort_key(status_id):
+    # Mastodon IDs are numbers and Pleroma's fixed length strings; padding
+    # makes both sort correctly as text
+    return str(status_id).rjust(32, "0")
+
+
+class TimelineStore:
+    """
+    TimelineStore keeps timelines (home, local, lists) in a SQLite database
+    so they can be shown and paged through without fetching them again, and
+    brought up to date by fetching only what is new.
+
+    A timeline is stored as the statuses we fetched from it, newest first.
+    Those don't have to be contiguous: each status has a `gap` flag that is
+    set when there may be statuses we haven't fetched between it and the
+    next older stored status.  Reading stops at a gap, so the caller knows
+    to fetch the missing statuses first.
+
+    Only the newest `max_rows` statuses of each timeline are kept.
+
+    The store may be used from a background sync thread and the main thread
+    at the same time.
+    """
+
+    def __init__(self, max_rows=5000):
+        self.max_rows = max_rows
+        self._db = None
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS timeline ("
+            "timeline TEXT NOT NULL, sort TEXT NOT NULL, id TEXT NOT NULL, "
+            "gap INTEGER NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (timeline, sort)) WITHOUT ROWID"
+        )
+        db.commit()
+        with self._lock:
+            self._db = db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @property
+    def is_open(self):
+        return self._db is not None
+
+    def timelines(self):
+        """Returns the names of the stored timelines."""
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT timeline FROM timeline")
+            return [row[0] for row in rows]
+
+    def newest(self, timeline):
+        """Returns the ID of the newest stored status, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM timeline WHERE timeline = ? ORDER BY sort DESC LIMIT 1",
+                (timeline,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def gaps(self, timeline):
+        """Returns the IDs of statuses with a gap below them, newest first.
+        The oldest stored status isn't included: nothing is missing between
+        it and anything stored."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM timeline WHERE timeline = ? AND gap = 1 "
+                "AND sort > (SELECT MIN(sort) FROM timeline WHERE timeline = ?) "
+                "ORDER BY sort DESC",
+                (timeline, timeline),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def older(self, timeline, max_id=None, limit=20):
+        """Returns up to limit stored statuses older than max_id (or the
+        newest ones), newest first, and whether they are complete.  They
+        are incomplete when a gap or the oldest stored status was reached
+        before finding limit statuses."""
+        with self._lock:
+            if max_id is None:
+                rows = self._db.execute(
+                    "SELECT gap, data FROM timeline WHERE timeline = ? "
+                    "ORDER BY sort DESC LIMIT ?",
+                    (timeline, limit),
+                ).fetchall()
+                gap = 0
+            else:
+                rows = self._db.execute(
+                    "SELECT gap, data FROM timeline WHERE timeline = ? AND sort < ? "
+                    "ORDER BY sort DESC LIMIT ?",
+                    (timeline, sort_key(max_id), limit),
+                ).fetchall()
+                row = self._db.execute(
+                    "SELECT gap FROM timeline WHERE timeline = ? AND sort = ?",
+                    (timeline, sort_key(max_id)),
+                ).fetchone()
+                gap = row[0] if row else 1
+        if gap:
+            return [], False
+        statuses = []
+        for gap, data in rows:
+            statuses.append(load_status(data))
+            if gap:
+                break
+        return statuses, len(statuses) == limit
+
+    def newer(self, timeline, min_id, limit=20):
+        """Returns up to limit stored statuses newer than min_id, newest
+        first, and whether they are complete (see older())."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT gap, data FROM timeline WHERE timeline = ? AND sort > ? "
+                "ORDER BY sort ASC LIMIT ?",
+                (timeline, sort_key(min_id), limit),
+            ).fetchall()
+        statuses = []
+        for gap, data in rows:
+            # a gap below this status means it doesn't follow the previous one
+            if gap:
+                break
+            statuses.append(load_status(data))
+        complete = len(statuses) == limit
+        statuses.reverse()
+        return statuses, complete
+
+    def add_newer(self, timeline, statuses):
+        """Store a page fetched with min_id: the statuses directly newer
+        than min_id, so there are no gaps between any of them."""
+        rows = [
+            (timeline, sort_key(s["id"]), str(s["id"]), 0, dump_status(s))
+            for s in statuses
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO timeline (timeline, sort, id, gap, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._trim(timeline)
+            self._db.commit()
+
+    def add_older(self, timeline, statuses, max_id=None, limit=40):
+        """Store a page fetched with max_id (or without either cursor): the
+        statuses directly older than max_id.  limit is the page size that
+        was asked for; a shorter page means the end of the timeline."""
+        statuses = sorted(statuses, key=lambda s: sort_key(s["id"]), reverse=True)
+        with self._lock:
+            if max_id is not None:
+                self._db.execute(
+                    "UPDATE timeline SET gap = 0 WHERE timeline = ? AND sort = ?",
+                    (timeline, sort_key(max_id)),
+                )
+            rows = []
+            reached_stored = False
+            for status in statuses:
+                sort = sort_key(status["id"])
+                stored = self._db.execute(
+                    "SELECT 1 FROM timeline WHERE timeline = ? AND sort = ?",
+                    (timeline, sort),
+                ).fetchone()
+                if stored:
+                    # the rest is stored already, with its own gap flags
+                    reached_stored = True
+                    break
+                rows.append([timeline, sort, str(status["id"]), 0, dump_status(status)])
+            if rows and not reached_stored and len(statuses) >= limit:
+                rows[-1][3] = 1
+            self._db.executemany(
+                "INSERT INTO timeline (timeline, sort, id, gap, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._trim(timeline)
+            self._db.commit()
+
+    def replace(self, timeline, statuses, max_id=None, min_id=None, stored=()):
+        """Store a page fetched again with max_id, min_id or neither cursor.
+        The stored statuses in the range the page covers are replaced by
+        it, so counts, edits and deletions are up to date.
+
+        stored are the statuses the page had before.  If the page came back
+        empty, they were all deleted, so the range they cover is emptied."""
+        statuses = sorted(statuses, key=lambda s: sort_key(s["id"]), reverse=True)
+        span = statuses or sorted(stored, key=lambda s: sort_key(s["id"]), reverse=True)
+        if not span:
+            return
+        newest = sort_key(span[0]["id"])
+        oldest = sort_key(span[-1]["id"])
+        if min_id is not None:
+            where, bounds = "sort > ? AND sort <= ?", (sort_key(min_id), newest)
+        elif max_id is not None:
+            where, bounds = "sort >= ? AND sort < ?", (oldest, sort_key(max_id))
+        else:
+            where, bounds = "sort >= ?", (oldest,)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT gap FROM timeline WHERE timeline = ? AND sort = ?",
+                (timeline, oldest),
+            ).fetchone()
+            # a page fetched with min_id follows on from min_id; otherwise
+            # there may be statuses missing below one we didn't have
+            if row is not None:
+                gap = row[0]
+            else:
+                gap = 0 if min_id is not None else 1
+            self._db.execute(
+                "DELETE FROM timeline WHERE timeline = ? AND " + where,
+                (timeline,) + bounds,
+            )
+            self._db.executemany(
+                "INSERT INTO timeline (timeline, sort, id, gap, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        timeline,
+                        sort_key(s["id"]),
+                        str(s["id"]),
+                        gap if i == len(statuses) - 1 else 0,
+                        dump_status(s),
+                    )
+                    for i, s in enumerate(statuses)
+                ],
+            )
+            self._db.commit()
+
+    def _trim(self, timeline):
+        self._db.execute(
+            "DELETE FROM timeline WHERE timeline = ? AND sort < "
+            "(SELECT sort FROM timeline WHERE timeline = ? "
+            "ORDER BY sort DESC LIMIT 1 OFFSET ?)",
+            (timeline, timeline, self.max_rows - 1),
+        )
+
+
+def sync_timeline(store, timeline, fetch, limit=40, max_pages=10):
+    """Fetch the statuses newer than the newest stored one into the store.
+
+    fetch is the Mastodon timeline method, taking min_id, max_id and limit.
+    Pages are fetched with min_id, oldest first, so they follow on from what
+    is stored.  If there is more than max_pages of them, the newest page is
+    fetched instead and the gap is left to be filled later (see
+    fill_gaps()).  Returns the number of statuses added."""
+    newest = store.newest(timeline)
+    if newest is None:
+        page = fetch(limit=limit) or []
+        store.add_older(timeline, page, limit=limit)
+        return len(page)
+
+    added = 0
+    for _ in range(max_pages):
+        page = fetch(min_id=newest, limit=limit)
+        if not page:
+            return added
+        store.add_newer(timeline, page)
+        added += len(page)
+        newest = max((s["id"] for s in page), key=sort_key)
+        if len(page) < limit:
+            return added
+    page = fetch(limit=limit) or []
+    store.add_older(timeline, page, limit=limit)
+    return added + len(page)
+
+
+def fill_gaps(store, timeline, fetch, limit=40, max_pages=10):
+    """Fetch statuses missing between stored ones, newest gaps first, using
+    at most max_pages requests.  Returns the number of requests made."""
+    requests = 0
+    while requests < max_pages:
+        gaps = store.gaps(timeline)
+        if not gaps:
+            break
+        page = fetch(max_id=gaps[0], limit=limit) or []
+        store.add_older(timeline, page, gaps[0], limit)
+        requests += 1
+    return requests
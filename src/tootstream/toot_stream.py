@@ -0,0 +1,357 @@
+import json
+import threading
+import time
+from collections import deque
+
+# What StreamQueue.put() does when the queue is full:
+#   block - wait for the renderer, which in turn stalls the stream reader
+#   drop-oldest - silently forget the oldest queued event
+#   summarize - forget the oldest queued event and report how many were skipped
+OVERFLOW_POLICIES = ("block", "drop-oldest", "summarize")
+
+
+class StreamQueue:
+    """
+    StreamQueue sits between a stream listener, which receives events on
+    the network thread, and the renderer thread that shows them.
+
+    The queue holds at most `maxsize` events.  What happens when it is full
+    depends on `policy`, one of OVERFLOW_POLICIES.
+
+    The counters `received`, `dropped` and `max_depth` are kept for the
+    lifetime of the queue; `depth` is the number of events waiting.
+    """
+
+    def __init__(self, maxsize=500, policy="summarize"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.received = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._events = deque()
+        self._skipped = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def depth(self):
+        return len(self._events)
+
+    def put(self, event):
+        """Queue an event, applying the overflow policy if the queue is
+        full.  Events put after close() are ignored."""
+        with self._cond:
+            if self.policy == "block":
+                while len(self._events) >= self.maxsize and not self._closed:
+                    self._cond.wait()
+            if self._closed:
+                return
+            self.received += 1
+            if len(self._events) >= self.maxsize:
+                self._events.popleft()
+                self.dropped += 1
+                if self.policy == "summarize":
+                    self._skipped += 1
+            self._events.append(event)
+            self.max_depth = max(self.max_depth, len(self._events))
+            self._cond.notify_all()
+
+    def get_batch(self, timeout=None):
+        """Wait up to timeout seconds for events and take all of them.
+
+        Returns (events, skipped), where skipped is the number of events
+        dropped since the last batch under the 'summarize' policy.  Both are
+        empty once the queue is closed and drained."""
+        with self._cond:
+            if not self._events and not self._skipped and not self._closed:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            skipped, self._skipped = self._skipped, 0
+            self._cond.notify_all()
+            return events, skipped
+
+    def close(self):
+        """Stop accepting events and wake up anyone waiting."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class StreamRenderer:
+    """
+    StreamRenderer shows queued stream events on its own thread.
+
+    Events are handed to `flush(events, skipped)` in batches, at most `fps`
+    times a second, so a busy stream results in a few large writes rather
+    than one per event.
+
+      queue - The StreamQueue to take events from.
+      flush - Called with a list of events and the number of skipped events.
+    """
+
+    def __init__(self, queue, flush, fps=10):
+        self.queue = queue
+        self.flush = flush
+        self.fps = fps
+        self.frames = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Close the queue and wait for the remaining events to be shown."""
+        self.queue.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        interval = 1.0 / self.fps if self.fps else 0
+        while True:
+            events, skipped = self.queue.get_batch(timeout=0.5)
+            if not events and not skipped:
+                if self.queue.closed:
+                    return
+                continue
+            started = time.monotonic()
+            try:
+                self.flush(events, skipped)
+            except Exception:
+                # a toot we can't show mustn't end the stream
+                pass
+            self.frames += 1
+            remaining = interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+class Subscription:
+    """A stream subscribed to on a MultiplexStream.
+
+    The subscription remembers the IDs of the last `seen_size` statuses
+    delivered on it, so statuses fetched again after a reconnect can be
+    recognised, and `last_id`, the newest status ID seen.
+
+      label - The name the subscription is shown and removed by.
+      stream - Streaming API stream name: user, public, public:local,
+               hashtag or list.
+      params - Extra subscribe parameters, e.g. {"tag": "python"}.
+    """
+
+    def __init__(self, label, stream, params=None, seen_size=1000):
+        self.label = label
+        self.stream = stream
+        self.params = params or {}
+        self.received = 0
+        self.last_id = None
+        self.seen_size = seen_size
+        self._seen = set()
+        self._seen_order = deque()
+
+    def mark_seen(self, status_id):
+        """Record that a status was delivered.  Returns False if it had
+        been delivered already."""
+        status_id = str(status_id)
+        if status_id in self._seen:
+            return False
+        self._seen.add(status_id)
+        self._seen_order.append(status_id)
+        if len(self._seen_order) > self.seen_size:
+            self._seen.discard(self._seen_order.popleft())
+        if self.last_id is None or id_order(status_id) > id_order(self.last_id):
+            self.last_id = status_id
+        return True
+
+    @property
+    def key(self):
+        """Identifies the stream in the "stream" field of server messages."""
+        return stream_key([self.stream] + [str(v) for v in self.params.values()])
+
+    def message(self, kind):
+        return json.dumps(dict(type=kind, stream=self.stream, **self.params))
+
+
+def stream_key(names):
+    return tuple(name.lower() for name in names)
+
+
+def id_order(status_id):
+    """Sort key for status IDs.  Mastodon's are numbers and Pleroma's fixed
+    length strings, both too long to compare as plain strings."""
+    return (len(status_id), status_id)
+
+
+class MultiplexStream:
+    """
+    MultiplexStream carries any number of streaming API subscriptions over
+    a single websocket.
+
+    Events are passed to `on_event(subscription, event, payload)` on the
+    stream's own thread; the payload is left as the JSON text the server
+    sent.  When the connection drops, it is opened again after a delay that
+    doubles up to `max_wait` seconds, and every subscription is renewed.
+    Connection problems are reported to `on_error(exception)`.
+
+    After connecting, `on_connect(connects)` is called on the same thread
+    before any event is read, with the number of connections made so far.
+    Events sent meanwhile wait on the socket, which allows filling in what
+    was missed while disconnected without events arriving out of order.
+
+      url - The streaming API websocket URL (wss://.../api/v1/streaming).
+      access_token - Sent as a bearer token when connecting.
+    """
+
+    def __init__(
+        self,
+        url,
+        access_token,
+        on_event,
+        on_error=None,
+        on_connect=None,
+        wait=5,
+        max_wait=300,
+        timeout=120,
+    ):
+        self.url = url
+        self.access_token = access_token
+        self.on_event = on_event
+        self.on_error = on_error
+        self.on_connect = on_connect
+        self.wait = wait
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.connects = 0
+        self._subscriptions = {}
+        self._ws = None
+        self._thread = None
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._ws is not None
+
+    @property
+    def subscriptions(self):
+        with self._lock:
+            return list(self._subscriptions.values())
+
+    def subscribe(self, subscription):
+        """Add a subscription.  Raises ValueError if its label is in use or
+        the same stream is subscribed already."""
+        with self._lock:
+            if subscription.label in self._subscriptions:
+                raise ValueError("Already streaming {}".format(subscription.label))
+            for other in self._subscriptions.values():
+                if other.key == subscription.key:
+                    raise ValueError("Already streaming as {}".format(other.label))
+            self._subscriptions[subscription.label] = subscription
+            self._send(subscription.message("subscribe"))
+
+    def unsubscribe(self, label):
+        """Remove the subscription with label and return it, or None."""
+        with self._lock:
+            subscription = self._subscriptions.pop(label, None)
+            if subscription is not None:
+                self._send(subscription.message("unsubscribe"))
+            return subscription
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5):
+        self._closed.set()
+        with self._lock:
+            ws = self._ws
+        if ws is not None:
+            try:
+                ws.close(timeout=1)
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _send(self, message):
+        # called with the lock held; subscriptions are sent on (re)connect
+        # when we aren't connected right now
+        if self._ws is None:
+            return
+        try:
+            self._ws.send(message)
+        except Exception:
+            pass
+
+    def _report(self, e):
+        if self.on_error is not None:
+            self.on_error(e)
+
+    def _connect(self):
+        import websocket
+
+        ws = websocket.create_connection(
+            self.url,
+            header=["Authorization: Bearer {}".format(self.access_token)],
+            timeout=self.timeout,
+        )
+        with self._lock:
+            self._ws = ws
+            for subscription in self._subscriptions.values():
+                ws.send(subscription.message("subscribe"))
+        self.connects += 1
+        return ws
+
+    def _run(self):
+        wait = self.wait
+        while not self._closed.is_set():
+            try:
+                ws = self._connect()
+            except Exception as e:
+                if self._closed.is_set():
+                    return
+                self._report(e)
+                self._closed.wait(wait)
+                wait = min(wait * 2, self.max_wait)
+                continue
+
+            wait = self.wait
+            try:
+                if self.on_connect is not None:
+                    self.on_connect(self.connects)
+                while not self._closed.is_set():
+                    self._dispatch(ws.recv())
+            except Exception as e:
+                if not self._closed.is_set():
+                    self._report(e)
+            finally:
+                with self._lock:
+                    self._ws = None
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+            self._closed.wait(wait)
+
+    def _dispatch(self, text):
+        if not text:
+            return
+        try:
+            message = json.loads(text)
+            key = stream_key(message["stream"])
+            event = message["event"]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+        with self._lock:
+            matches = [s for s in self._subscriptions.values() if s.key == key]
+        for subscription in matches:
+            self.on_event(subscription, event, message.get("payload"))